@@ -1,37 +1,198 @@
 import os
 import sys
+import mmap
+import functools
+import argparse
 import numpy as np
-from typing import List, Dict, Union, Callable
+from typing import List, Dict, Union, Callable, Optional
 
-
-PATH_TO_DATA = "/home/akhakhar/data/APPS/test/"
 BASE_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(ROOT_DIR)
 sys.path.append(BASE_DIR)
 
-from ast_helper import get_num_nodes_from_code
+from ast_helper import get_num_nodes_from_code, iter_suffix_num_nodes
 
 from utils import utils
+import config
+
+PATH_TO_DATA = config.get("APPS_PATH")
+PATH_TO_PACK = config.get("APPS_PACK_PATH")
+PACK_MAGIC = b"APPSPAK1"
 
 
 def fetch_data_from_index(i: int) -> Dict[str, Union[str, Dict]]:
     """
     Fetches question and solutions data from a specified index.
 
+    The packed dataset is used when it exists, otherwise the files of the problem are read.
+
     Args:
         i (int): The index from which to fetch the data.
 
     Returns:
         dict: A dictionary containing the question and solutions data.
     """
-
+    packed = load_packed_dataset()
+    if packed is not None:
+        return {
+            "question": packed.question(i),
+            "solutions": [
+                packed.solution(i, j) for j in range(packed.num_solutions(i))
+            ],
+        }
     zero_padded = "0" * (4 - len(str(i))) + str(i)
     question = utils.read_file(PATH_TO_DATA + "/" + zero_padded + "/question.txt")
     solutions = utils.read_json(PATH_TO_DATA + "/" + zero_padded + "/solutions.json")
     return {"question": question, "solutions": solutions}
 
 
+def fetch_question(i: int) -> str:
+    """
+    Fetches the question of a problem, without reading its solutions.
+
+    Args:
+        i (int): The index of the problem.
+
+    Returns:
+        str: The question.
+    """
+    packed = load_packed_dataset()
+    if packed is not None:
+        return packed.question(i)
+    zero_padded = "0" * (4 - len(str(i))) + str(i)
+    return utils.read_file(PATH_TO_DATA + "/" + zero_padded + "/question.txt")
+
+
+def fetch_solution(i: int, j: int) -> str:
+    """
+    Fetches a single solution of a problem, without decoding the others when the packed dataset exists.
+
+    Args:
+        i (int): The index of the problem.
+        j (int): The index of the solution.
+
+    Returns:
+        str: The solution.
+    """
+    packed = load_packed_dataset()
+    if packed is not None:
+        return packed.solution(i, j)
+    return fetch_data_from_index(i)["solutions"][j]
+
+
+def pack_dataset(data_path: str = PATH_TO_DATA, pack_path: str = PATH_TO_PACK) -> int:
+    """
+    Packs the questions and solutions of the problem directories of an APPS split into a single indexed file.
+
+    The file holds the magic bytes, the number of problems and of solutions as uint64, the index of the first
+    solution of each problem, the byte offsets of each question and of each solution, then the UTF-8 text of all
+    questions and solutions. Offsets are relative to the start of the text. Problems without solutions.json have
+    no solutions.
+
+    Args:
+        data_path (str, optional): The directory of the split. Defaults to PATH_TO_DATA.
+        pack_path (str, optional): The path of the packed file. Defaults to PATH_TO_PACK.
+
+    Returns:
+        int: The number of problems packed.
+    """
+    num_problems = len([d for d in os.listdir(data_path) if d.isdigit()])
+    questions = []
+    solutions = []
+    first_solution = [0]
+    for i in range(num_problems):
+        problem_dir = f"{data_path}/{i:04d}"
+        questions.append(utils.read_file(problem_dir + "/question.txt").encode("utf-8"))
+        if os.path.exists(problem_dir + "/solutions.json"):
+            solutions += [
+                s.encode("utf-8")
+                for s in utils.read_json(problem_dir + "/solutions.json")
+            ]
+        first_solution.append(len(solutions))
+    texts = questions + solutions
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.uint64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+    with open(pack_path + ".tmp", "wb") as f:
+        f.write(PACK_MAGIC)
+        f.write(np.array([num_problems, len(solutions)], dtype=np.uint64).tobytes())
+        f.write(np.array(first_solution, dtype=np.uint64).tobytes())
+        f.write(text_offsets.tobytes())
+        for t in texts:
+            f.write(t)
+    # the packed file only appears once complete
+    os.replace(pack_path + ".tmp", pack_path)
+    return num_problems
+
+
+class PackedDataset:
+    """
+    Reads a dataset written by pack_dataset through a memory map, decoding only the requested texts.
+
+    Attributes:
+        mm (mmap.mmap): The memory map of the packed file.
+        num_problems (int): The number of problems.
+        first_solution (np.ndarray): The index of the first solution of each problem, and the total number of solutions.
+        text_offsets (np.ndarray): The byte offsets of the questions, then of the solutions, and of the end of the text.
+        text_start (int): The position of the text in the file.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError(f"{path} is not a packed APPS dataset")
+        pos = len(PACK_MAGIC)
+        self.num_problems, num_solutions = (
+            int(x) for x in np.frombuffer(self.mm, dtype=np.uint64, count=2, offset=pos)
+        )
+        pos += 16
+        self.first_solution = np.frombuffer(
+            self.mm, dtype=np.uint64, count=self.num_problems + 1, offset=pos
+        )
+        pos += 8 * (self.num_problems + 1)
+        num_texts = self.num_problems + num_solutions
+        self.text_offsets = np.frombuffer(
+            self.mm, dtype=np.uint64, count=num_texts + 1, offset=pos
+        )
+        self.text_start = pos + 8 * (num_texts + 1)
+
+    def __len__(self) -> int:
+        return self.num_problems
+
+    def text(self, k: int) -> str:
+        start = self.text_start + int(self.text_offsets[k])
+        end = self.text_start + int(self.text_offsets[k + 1])
+        return self.mm[start:end].decode("utf-8")
+
+    def question(self, i: int) -> str:
+        return self.text(i)
+
+    def num_solutions(self, i: int) -> int:
+        return int(self.first_solution[i + 1] - self.first_solution[i])
+
+    def solution(self, i: int, j: int) -> str:
+        if not 0 <= j < self.num_solutions(i):
+            raise IndexError(f"problem {i} has no solution {j}")
+        return self.text(self.num_problems + int(self.first_solution[i]) + j)
+
+
+@functools.lru_cache(maxsize=None)
+def load_packed_dataset(path: str = PATH_TO_PACK) -> Optional[PackedDataset]:
+    """
+    Opens the packed dataset once per path.
+
+    Args:
+        path (str, optional): The path of the packed file. Defaults to PATH_TO_PACK.
+
+    Returns:
+        PackedDataset: The packed dataset, or None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    return PackedDataset(path)
+
+
 def prepare_inference_prompt_solution(
     question: str,
     solution: str,
@@ -58,9 +219,14 @@ def prepare_inference_prompt_solution(
     solution_lst = [line for line in solution.split("\n") if len(line.strip()) > 0]
     lines_shown = n(len(solution_lst))
     next_line = solution_lst[lines_shown].strip()
-    # make sure the line is complicated enough to be a good sample
-    while get_num_nodes_from_code(next_line) < min_ast_num_nodes and lines_shown > 0:
-        lines_shown -= 1
+    # make sure the line is complicated enough to be a good sample, otherwise take the shortest longer suffix that is
+    if get_num_nodes_from_code(next_line) < min_ast_num_nodes and lines_shown > 0:
+        first_line = lines_shown
+        for lines_shown, num_nodes in iter_suffix_num_nodes(solution_lst):
+            if lines_shown < first_line and (
+                num_nodes >= min_ast_num_nodes or lines_shown == 0
+            ):
+                break
         next_line = "\n".join(solution_lst[lines_shown:])
     first_n = "\n".join(solution_lst[:lines_shown])
     return {
@@ -72,6 +238,11 @@ def prepare_inference_prompt_solution(
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pack", action="store_true")
+    args = parser.parse_args()
+    if args.pack:
+        print(pack_dataset(), "problems packed in", PATH_TO_PACK)
     for i in range(5):
         question_data = fetch_data_from_index(i)
         x = prepare_inference_prompt_solution(
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(ROOT_DIR)
+sys.path.append(BASE_DIR)
+
+from pac import compute_k_array
+from utils import utils
+
+RESULTS_DIR = f"{ROOT_DIR}/results"
+# columns of the aggregate, one row per (sample, m, tau) record
+COLUMNS = ["sample", "m", "tau_ind", "cost", "covered", "frac_included"]
+DTYPES = {
+    "sample": np.int64,
+    "m": np.int64,
+    "tau_ind": np.int64,
+    "cost": float,
+    "covered": bool,
+    "frac_included": float,
+}
+# arrays of the curves of one m, as returned by coverage_curves
+CURVES = ["taus", "coverage", "frac_rm", "counts"]
+
+
+def output_path(q: int, m: int, results_dir: str = RESULTS_DIR) -> Optional[str]:
+    """
+    Finds the optimize_runner output of a sample and m, preferring the compact, then JSONL, then JSON format.
+
+    Args:
+        q (int): The index of the sample, the --dataind of the run.
+        m (int): The maximum number of holes in the tree.
+        results_dir (str, optional): The directory of the outputs. Defaults to RESULTS_DIR.
+
+    Returns:
+        str: The path of the output, possibly compressed, or None if there is none.
+    """
+    prefix = f"{results_dir}/optimize_output_ind_{q}__m_{m}"
+    for ext in ["compact.jsonl", "jsonl", "json"]:
+        path = utils.resolve_path(f"{prefix}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def iter_output_columns(path: str) -> Iterator[Tuple[List, List, List, List]]:
+    """
+    Reads the per-tau columns of an output, sample record by sample record, without rebuilding the trees.
+
+    Args:
+        path (str): The path of the output.
+
+    Yields:
+        tuple: The tau indices, costs, whether the target contains the pruned prediction, and included fractions.
+    """
+    if ".compact.jsonl" in path:
+        # compact records already store each per-tau field as a column
+        for compressed in utils.iter_jsonl(path):
+            yield (
+                compressed["tau_ind"],
+                compressed["cost"],
+                [p["eval"] for p in compressed["pred_in_target"]],
+                compressed["frac_included"],
+            )
+        return
+    records = (
+        utils.iter_jsonl(path) if ".jsonl" in path else utils.read_json(path)["output"]
+    )
+    for r in records:
+        yield (
+            [r["tau_ind"]],
+            [r["cost"]],
+            [r["pred_in_target"]["eval"]],
+            [r["output"]["frac_included"]],
+        )
+
+
+def load_output(path: str, q: int, m: int) -> Dict[str, np.ndarray]:
+    """
+    Loads one output into columns.
+
+    A record that cannot be decoded, such as the last one of an output still being written, ends the output.
+
+    Args:
+        path (str): The path of the output.
+        q (int): The index of the sample.
+        m (int): The maximum number of holes in the tree.
+
+    Returns:
+        dict: The array of each of COLUMNS.
+    """
+    lists = {key: [] for key in ["tau_ind", "cost", "covered", "frac_included"]}
+    try:
+        for tau_ind, cost, covered, frac_included in iter_output_columns(path):
+            lists["tau_ind"] += tau_ind
+            lists["cost"] += cost
+            lists["covered"] += covered
+            lists["frac_included"] += frac_included
+    except (ValueError, EOFError):
+        print("stopped reading", path, "at an incomplete record", flush=True)
+    columns = {key: np.array(lists[key], dtype=DTYPES[key]) for key in lists}
+    num_rows = len(columns["tau_ind"])
+    columns["sample"] = np.full(num_rows, q, dtype=np.int64)
+    columns["m"] = np.full(num_rows, m, dtype=np.int64)
+    return columns
+
+
+def concat_columns(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Concatenates the columns of several outputs.
+
+    Args:
+        parts (List[dict]): The columns of each output.
+
+    Returns:
+        dict: The array of each of COLUMNS.
+    """
+    return {
+        key: np.concatenate(
+            [part[key] for part in parts] + [np.zeros(0, dtype=DTYPES[key])]
+        )
+        for key in COLUMNS
+    }
+
+
+def file_stat(path: str) -> List[int]:
+    """
+    Reads the size and modification time of a file, which identify its content without reading it.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        list: The size in bytes and the modification time in nanoseconds of the file.
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def fingerprint(obj: Any) -> str:
+    """
+    Hashes a JSON serializable object, such as a plot configuration.
+
+    Args:
+        obj (Any): The object to hash.
+
+    Returns:
+        str: The hex digest of the canonical JSON of the object.
+    """
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def find_outputs(
+    ms: List[int], num_samples: int = 90, results_dir: str = RESULTS_DIR
+) -> List[Tuple[int, int, str]]:
+    """
+    Finds the outputs of every sample and m.
+
+    Args:
+        ms (List[int]): The maximum numbers of holes.
+        num_samples (int, optional): The number of samples. Defaults to 90.
+        results_dir (str, optional): The directory of the outputs. Defaults to RESULTS_DIR.
+
+    Returns:
+        list: The sample index, m and path of each existing output.
+    """
+    paths = [
+        (q, m, output_path(q, m, results_dir)) for m in ms for q in range(num_samples)
+    ]
+    return [(q, m, path) for q, m, path in paths if path is not None]
+
+
+def coverage_curves(columns: Dict[str, np.ndarray], m: int) -> Dict[str, np.ndarray]:
+    """
+    Computes the coverage and nodes removed of each tau for one m, grouping the records by tau index.
+
+    Args:
+        columns (dict): The columns of the aggregate.
+        m (int): The maximum number of holes.
+
+    Returns:
+        dict: The taus in order of tau index, the percentage of records whose target contains the pruned prediction,
+            the mean percentage of nodes removed, and the number of records of each tau.
+    """
+    rows = columns["m"] == m
+    tau_ind = columns["tau_ind"][rows]
+    tau_inds, first, group = np.unique(tau_ind, return_index=True, return_inverse=True)
+    group = group.reshape(-1)
+    counts = np.bincount(group, minlength=len(tau_inds))
+    covered = np.bincount(
+        group, weights=columns["covered"][rows], minlength=len(tau_inds)
+    )
+    frac_included = np.bincount(
+        group, weights=columns["frac_included"][rows], minlength=len(tau_inds)
+    )
+    return {
+        "taus": np.exp(-1 * columns["cost"][rows][first]),
+        "coverage": covered / counts * 100,
+        "frac_rm": 100 - frac_included / counts * 100,
+        "counts": counts,
+    }
+
+
+def load_curves(
+    m: int,
+    num_samples: int = 90,
+    results_dir: str = RESULTS_DIR,
+    cache_dir: Optional[str] = None,
+    refresh: bool = False,
+) -> Tuple[Dict[str, np.ndarray], str]:
+    """
+    Computes the curves of one m, reusing the cached curves if none of its outputs changed size or modification time.
+
+    Only the outputs are listed and stat-ed on a cache hit, none of them is read.
+
+    Args:
+        m (int): The maximum number of holes.
+        num_samples (int, optional): The number of samples. Defaults to 90.
+        results_dir (str, optional): The directory of the outputs. Defaults to RESULTS_DIR.
+        cache_dir (str, optional): The directory of the .npz cache of the curves, or None not to cache. Defaults to
+            None.
+        refresh (bool, optional): Whether to recompute the curves even if they are cached. Defaults to False.
+
+    Returns:
+        tuple: The curves, as returned by coverage_curves, and the fingerprint of the outputs they are computed from.
+    """
+    paths = find_outputs([m], num_samples, results_dir)
+    inputs_fingerprint = fingerprint(
+        [[q, os.path.basename(path), *file_stat(path)] for q, _, path in paths]
+    )
+    cache_path = None if cache_dir is None else f"{cache_dir}/curves__m_{m}.npz"
+    if cache_path is not None and not refresh and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if str(cached["fingerprint"]) == inputs_fingerprint:
+                return {key: cached[key] for key in CURVES}, inputs_fingerprint
+    columns = concat_columns([load_output(path, q, m) for q, m, path in paths])
+    curves = coverage_curves(columns, m)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, fingerprint=inputs_fingerprint, **curves)
+    return curves, inputs_fingerprint
+
+
+def map_e_to_taus(
+    curves: Dict[str, np.ndarray], e: np.ndarray, d: float
+) -> Dict[str, Any]:
+    """
+    Selects, for each error rate, the smallest tau whose coverage reaches the PAC target coverage.
+
+    The first tau reaching a coverage is the first one where the running maximum of the coverage reaches it, so it
+    is found with a binary search. Error rates without such a tau are dropped.
+
+    Args:
+        curves (dict): The curves of one m, as returned by coverage_curves.
+        e (np.ndarray): The error rates.
+        d (float): The probability that the error rate is not met.
+
+    Returns:
+        dict: The target coverage of each error rate, and the tau, coverage and percentage of nodes removed of each
+            error rate with a satisfying tau.
+    """
+    n = int(curves["counts"][-1]) if len(curves["counts"]) > 0 else -1
+    target_coverage = 100 - compute_k_array(n, e, d) / n * 100
+    j = np.searchsorted(
+        np.maximum.accumulate(curves["coverage"]), target_coverage, side="left"
+    )
+    found = j < len(curves["coverage"])
+    j = j[found]
+    return {
+        "n": n,
+        "target_coverage": target_coverage,
+        "taus": curves["taus"][j],
+        "coverage": curves["coverage"][j],
+        "frac_rm": curves["frac_rm"][j],
+    }
@@ -1,7 +1,11 @@
 import ast
+import functools
 import traceback
 from colorama import Fore, Back, Style
-from typing import Optional
+from typing import Optional, List, Iterator, Tuple
+
+# node types whose unparsed code is always empty, so that CheckVisitor skips them
+EMPTY_NODE_TYPES = (ast.expr_context, ast.boolop, ast.operator, ast.unaryop, ast.cmpop)
 
 
 class Node:
@@ -119,6 +123,119 @@ class CheckVisitor(ast.NodeVisitor):
         return curr
 
 
+class PositionVisitor(ast.NodeVisitor):
+    """
+    A class to build a tree of Nodes from the source positions of an abstract syntax tree (AST) in a single pass.
+
+    Unlike CheckVisitor, the code of each node is the source segment of the node rather than its unparsed code, and
+    the start and end attributes are the offsets of the segment in the source. Children are ordered by position.
+
+    Attributes:
+        code (str): The parsed code.
+        line_offsets (list): The offset of the first character of each line in the code.
+    """
+
+    def __init__(self, code):
+        self.code = code
+        self.lines = code.splitlines(keepends=True)
+        self.line_offsets = [0]
+        for line in self.lines:
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+
+    def offset(self, lineno: int, col_offset: int) -> int:
+        """
+        Converts a line number and a UTF-8 byte column into a character offset in the code.
+
+        Args:
+            lineno (int): The 1-indexed line number.
+            col_offset (int): The byte offset in the line.
+
+        Returns:
+            int: The character offset in the code.
+        """
+        line = self.lines[lineno - 1] if lineno - 1 < len(self.lines) else ""
+        if not line.isascii():
+            col_offset = len(line.encode("utf-8")[:col_offset].decode("utf-8"))
+        return self.line_offsets[lineno - 1] + col_offset
+
+    def keyword_start(self, node: ast.AST, start: int) -> int:
+        """
+        Extends the start of a node without a position to include its leading keyword.
+
+        Args:
+            node (ast.AST): The AST node.
+            start (int): The start of the first child of the node.
+
+        Returns:
+            int: The start of the node including its leading keyword.
+        """
+        if isinstance(node, ast.comprehension):
+            start = self.code.rfind("for", 0, start)
+            if node.is_async:
+                start = self.code.rfind("async", 0, start)
+        elif isinstance(node, ast.match_case):
+            start = self.code.rfind("case", 0, start)
+        return start
+
+    def visit(self, node: ast.AST) -> Optional[Node]:
+        """
+        Visits a node in the abstract syntax tree (AST) and returns a new Node object.
+
+        Nodes without a position (such as comprehensions and arguments) span their children, and are empty if they
+        have no children. If the visited node is empty, it returns None.
+
+        Args:
+            node (ast.AST): The AST node to visit.
+
+        Returns:
+            Node: A new Node object with the source segment of the visited node and its children, or None if the visited node is empty.
+        """
+        children = []
+        for n in ast.iter_child_nodes(node):
+            c_node = self.visit(n)
+            if c_node is not None:
+                children.append(c_node)
+        children.sort(key=lambda c: c.start)
+        if isinstance(node, ast.Module):
+            start, end = 0, len(self.code)
+        elif getattr(node, "end_col_offset", None) is not None:
+            start = self.offset(node.lineno, node.col_offset)
+            end = self.offset(node.end_lineno, node.end_col_offset)
+        elif len(children) > 0:
+            start = self.keyword_start(node, children[0].start)
+            end = max([c.end for c in children])
+        else:
+            return None
+        if len(self.code[start:end].strip()) == 0:
+            return None
+        curr = Node(self.code[start:end])
+        curr.start = start
+        curr.end = end
+        curr.children = children
+        return curr
+
+
+def get_node_from_positions(code: str, print_traceback: bool = False) -> Optional[Node]:
+    """
+    Parses the given code into an abstract syntax tree (AST) and returns the root node, built from source positions.
+
+    Args:
+        code (str): The code to parse.
+        print_traceback (bool, optional): Whether to print the traceback if parsing fails. Defaults to False.
+
+    Returns:
+        Node: The root node of the AST, or None if parsing fails.
+    """
+    v = PositionVisitor(code)
+    try:
+        t = ast.parse(code)
+    except:
+        if print_traceback:
+            print(traceback.format_exc())
+        return None
+    return v.visit(t)
+
+
 def get_node(code: str, print_traceback: bool = False) -> Optional[Node]:
     """
     Parses the given code into an abstract syntax tree (AST) and returns the root node.
@@ -140,6 +257,53 @@ def get_node(code: str, print_traceback: bool = False) -> Optional[Node]:
     return v.visit(t)
 
 
+def is_empty_node(node: ast.AST) -> bool:
+    """
+    Checks whether the unparsed code of a node is empty, without unparsing it.
+
+    Args:
+        node (ast.AST): The AST node.
+
+    Returns:
+        bool: Whether ast.unparse(node) is empty.
+    """
+    if isinstance(node, EMPTY_NODE_TYPES):
+        return True
+    if isinstance(node, ast.arguments):
+        return not (
+            node.posonlyargs
+            or node.args
+            or node.vararg
+            or node.kwonlyargs
+            or node.kwarg
+        )
+    if isinstance(node, ast.Module):
+        return len(node.body) == 0
+    return False
+
+
+def count_nodes(tree: ast.AST) -> int:
+    """
+    Counts the nodes of the tree CheckVisitor would build from an abstract syntax tree (AST), without building it.
+
+    Args:
+        tree (ast.AST): The root of the AST.
+
+    Returns:
+        int: The number of nodes with non-empty code whose ancestors also have non-empty code.
+    """
+    if is_empty_node(tree):
+        return 0
+    count = 0
+    stack = [tree]
+    while len(stack) > 0:
+        node = stack.pop()
+        count += 1
+        stack += [c for c in ast.iter_child_nodes(node) if not is_empty_node(c)]
+    return count
+
+
+@functools.lru_cache(maxsize=1 << 16)
 def get_num_nodes_from_code(code: str) -> int:
     """
     Calculates the number of nodes in the abstract syntax tree (AST) for the given code.
@@ -150,13 +314,44 @@ def get_num_nodes_from_code(code: str) -> int:
     Returns:
         int: The number of nodes in the AST, or -1 if parsing fails.
     """
-    v = CheckVisitor(code)
     try:
         t = ast.parse(code)
     except:
         return -1
-    n = v.visit(t)
-    return total_nodes(n)
+    return count_nodes(t)
+
+
+def iter_suffix_num_nodes(lines: List[str]) -> Iterator[Tuple[int, int]]:
+    """
+    Calculates the number of nodes of every suffix of the given lines, from the shortest.
+
+    The lines are split into groups, each starting at an unindented line and parsing on its own. A suffix starting
+    at a group is the concatenation of the groups after it, so its count is the sum of their counts, and each group
+    is parsed once. Suffixes starting with indented code never parse. Other suffixes are parsed in full.
+
+    Args:
+        lines (List[str]): The lines of code.
+
+    Yields:
+        tuple: The index k of the first line and get_num_nodes_from_code("\n".join(lines[k:])).
+    """
+    # number of nodes of the statements of the groups from the start of the first group
+    num_statement_nodes = 0
+    group_start = len(lines)
+    for k in range(len(lines) - 1, -1, -1):
+        if lines[k][:1].isspace() and not lines[k].lstrip().startswith("#"):
+            yield k, -1
+            continue
+        num_group_nodes = -1
+        if not lines[k][:1].isspace():
+            num_group_nodes = get_num_nodes_from_code("\n".join(lines[k:group_start]))
+        if num_group_nodes == -1:
+            yield k, get_num_nodes_from_code("\n".join(lines[k:]))
+            continue
+        # the module node of the group is shared by the whole suffix
+        num_statement_nodes += max(num_group_nodes - 1, 0)
+        group_start = k
+        yield k, 1 + num_statement_nodes if num_statement_nodes > 0 else 0
 
 
 def check_code(code: str) -> bool:
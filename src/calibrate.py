@@ -0,0 +1,109 @@
+import os
+import sys
+import numpy as np
+from typing import List, Union
+import argparse
+
+BASE_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(ROOT_DIR)
+sys.path.append(BASE_DIR)
+
+import ast_helper
+import compact_tree
+import optimize_dp
+import optimize_runner
+from pac import compute_k_array
+from utils import utils
+
+
+def critical_cost(
+    target_tree: ast_helper.Node, pred_tree: ast_helper.Node, m: int
+) -> float:
+    """
+    Computes the largest maximum cost threshold below which the pruned prediction is a subtree of the target.
+
+    Every entry of the frontier of the prediction is checked against the target in a single walk. Thresholds are
+    mapped to entries as in Frontier.lookup, so the target contains the pruned prediction of every threshold below the
+    critical cost, and not at the critical cost.
+
+    Args:
+        target_tree (Node): The root node of the target tree.
+        pred_tree (Node): The root node of the prediction tree, with probabilities.
+        m (int): The maximum number of holes in the tree.
+
+    Returns:
+        float: The critical cost, inf if every threshold is contained, or -inf if none is.
+    """
+    frontier = optimize_dp.compute_frontier(pred_tree, m)
+    pred_in_target = compact_tree.is_subtree_batch(
+        compact_tree.CompactTree.from_node(target_tree),
+        compact_tree.CompactTree.from_node(pred_tree),
+        np.array([frontier.deleted_mask(ind) for ind in range(len(frontier))]),
+    )
+    # the last entry has the smallest cost and is also used below it
+    if not pred_in_target[-1]["eval"]:
+        return -np.inf
+    for ind in range(len(frontier) - 2, -1, -1):
+        if not pred_in_target[ind]["eval"]:
+            return float(frontier.costs[ind])
+    return np.inf
+
+
+def calibrate_taus(
+    critical_costs: List[float], e: Union[float, np.ndarray], d: float
+) -> np.ndarray:
+    """
+    Selects the largest maximum cost threshold, and so the smallest tau, that is probably approximately correct.
+
+    With k = compute_k(n, e, d), at most k of the n calibration samples may have a critical cost at or below the
+    threshold, so the threshold is just below the (k + 1)-th smallest critical cost.
+
+    Args:
+        critical_costs (List[float]): The critical cost of each calibration sample.
+        e (Union[float, np.ndarray]): The error rate, or an array of error rates.
+        d (float): The probability that the error rate is not met.
+
+    Returns:
+        np.ndarray: The tau of each error rate, as exp(-threshold), or nan if no threshold is valid.
+    """
+    costs = np.sort(np.asarray(critical_costs, dtype=float))
+    k = compute_k_array(len(costs), e, d)
+    padded = np.append(costs, np.inf)
+    max_costs = np.nextafter(padded[np.clip(k, 0, len(costs))], -np.inf)
+    max_costs = np.where((k < 0) | (max_costs == -np.inf), np.nan, max_costs)
+    return np.exp(-max_costs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--m", dest="m", type=int, default=1)
+    parser.add_argument("--d", dest="d", type=float, default=0.1)
+    args = parser.parse_args()
+    results = optimize_runner.retrieve_results(
+        [],
+        lambda x, output: output.append(utils.read_json(x)),
+        ["1672524017", "1672525916"],
+    )
+    critical_costs = []
+    for i, sample in enumerate(results):
+        print(f"[{i}/{len(results)-1}]{'-'*10}", flush=True)
+        parsed = optimize_runner.parse_sample(sample)
+        if parsed is None:
+            continue
+        _, _, pred_tree, target_tree = parsed
+        critical_costs.append(critical_cost(target_tree, pred_tree, args.m))
+    e = np.linspace(0.03, 0.65, num=50)
+    taus = calibrate_taus(critical_costs, e, args.d)
+    print("e", e.tolist())
+    print("taus", taus.tolist())
+    os.makedirs(f"{ROOT_DIR}/results", exist_ok=True)
+    utils.write_json(
+        f"{ROOT_DIR}/results/calibration__m_{args.m}.json",
+        {
+            "critical_costs": critical_costs,
+            "e": e.tolist(),
+            "d": args.d,
+            "taus": taus.tolist(),
+        },
+    )
@@ -2,15 +2,25 @@ import os
 import openai
 import sys
 import pprint
+from typing import List
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(ROOT_DIR)
+sys.path.append(BASE_DIR)
 
 from utils.utils import read_file
+import config
 
-PATH_TO_OPEN_AI_KEY = "/home/akhakhar/keys/OPEN_AI_API_KEY"
-openai.api_key = read_file(PATH_TO_OPEN_AI_KEY).strip("\n")
+PATH_TO_OPEN_AI_KEY = config.get("OPEN_AI_KEY_PATH")
+
+
+def load_api_key():
+    """
+    Sets the API key on first use, from the OPENAI_API_KEY environment variable or else the key file.
+    """
+    if openai.api_key is None:
+        openai.api_key = read_file(PATH_TO_OPEN_AI_KEY).strip("\n")
 
 
 def get_evaluation(
@@ -35,6 +45,7 @@ def get_evaluation(
     Returns:
         openai.openai_object.OpenAIObject: The generated completion.
     """
+    load_api_key()
     return openai.Completion.create(
         model=model,
         prompt=prompt,
@@ -47,6 +58,113 @@ def get_evaluation(
     )
 
 
+async def get_evaluation_async(
+    prompt: str,
+    logprobs: int = 1,
+    max_tokens: int = 50,
+    model: str = "code-davinci-002",
+) -> openai.openai_object.OpenAIObject:
+    """
+    Generate a completion for a given prompt without blocking the event loop, like get_evaluation.
+
+    Args:
+        prompt (str): The prompt to generate a completion for.
+        logprobs (int, optional): The number of most probable tokens to return for each position. Defaults to 1.
+        max_tokens (int, optional): The maximum number of tokens in the generated completion. Defaults to 50.
+        model (str, optional): The model to use for generating the completion. Defaults to "code-davinci-002".
+
+    Returns:
+        openai.openai_object.OpenAIObject: The generated completion.
+    """
+    load_api_key()
+    return await openai.Completion.acreate(
+        model=model,
+        prompt=prompt,
+        temperature=0,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0,
+        logprobs=logprobs,
+        max_tokens=max_tokens,
+    )
+
+
+def split_batch_response(
+    response: openai.openai_object.OpenAIObject, num_prompts: int
+) -> List[dict]:
+    """
+    Splits the response to a batch of prompts into the response of each prompt, shaped like get_evaluation.
+
+    The choice of prompt i has index i. The usage of the batch is not split between prompts, so it is dropped.
+
+    Args:
+        response (OpenAIObject): The response to the batch.
+        num_prompts (int): The number of prompts of the batch.
+
+    Returns:
+        list: The response of each prompt.
+    """
+    responses = []
+    for _ in range(num_prompts):
+        responses.append(
+            {key: response[key] for key in response if key not in ["choices", "usage"]}
+        )
+        responses[-1]["choices"] = []
+    for choice in response["choices"]:
+        responses[choice["index"]]["choices"].append(dict(choice, index=0))
+    return responses
+
+
+def get_evaluation_batch(
+    prompts: List[str],
+    logprobs: int = 1,
+    max_tokens: int = 50,
+    model: str = "code-davinci-002",
+) -> List[dict]:
+    """
+    Generate completions for a batch of prompts with a single request, like get_evaluation for each prompt.
+
+    Args:
+        prompts (List[str]): The prompts to generate completions for.
+        logprobs (int, optional): The number of most probable tokens to return for each position. Defaults to 1.
+        max_tokens (int, optional): The maximum number of tokens in each generated completion. Defaults to 50.
+        model (str, optional): The model to use for generating the completions. Defaults to "code-davinci-002".
+
+    Returns:
+        list: The response of each prompt.
+    """
+    return split_batch_response(
+        get_evaluation(prompts, logprobs=logprobs, max_tokens=max_tokens, model=model),
+        len(prompts),
+    )
+
+
+async def get_evaluation_batch_async(
+    prompts: List[str],
+    logprobs: int = 1,
+    max_tokens: int = 50,
+    model: str = "code-davinci-002",
+) -> List[dict]:
+    """
+    Generate completions for a batch of prompts with a single request, without blocking the event loop.
+
+    Args:
+        prompts (List[str]): The prompts to generate completions for.
+        logprobs (int, optional): The number of most probable tokens to return for each position. Defaults to 1.
+        max_tokens (int, optional): The maximum number of tokens in each generated completion. Defaults to 50.
+        model (str, optional): The model to use for generating the completions. Defaults to "code-davinci-002".
+
+    Returns:
+        list: The response of each prompt.
+    """
+    return split_batch_response(
+        await get_evaluation_async(
+            prompts, logprobs=logprobs, max_tokens=max_tokens, model=model
+        ),
+        len(prompts),
+    )
+
+
 if __name__ == "__main__":
     prompt = """
     # Python3. Only respond with the code to complete the line.
@@ -0,0 +1,161 @@
+from collections import deque
+import numpy as np
+from typing import List, Optional, Dict, Any, Iterator
+
+# per-tau fields of optimize_runner records that are not stored in the shared tree
+TAU_KEYS = ["pred_in_target", "cost", "tau", "tau_ind"]
+OUTPUT_KEYS = ["error_of_tree", "frac_included", "check"]
+
+
+def bfs_json_nodes(tree_json: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Lists the nodes of a serialized tree in breadth first order, the order used to number nodes in optimize.py.
+
+    Args:
+        tree_json (dict): The serialized root node, as returned by Node.toJSON, or None.
+
+    Returns:
+        list: The serialized nodes in breadth first order.
+    """
+    if tree_json is None:
+        return []
+    nodes = []
+    q = deque([tree_json])
+    while len(q) > 0:
+        curr = q.popleft()
+        nodes.append(curr)
+        q.extend(curr["children"])
+    return nodes
+
+
+def build_sample_output(
+    sample: Dict[str, Any],
+    tree: Optional[Dict[str, Any]],
+    deleted: np.ndarray,
+    map_inds: Optional[List[int]] = None,
+    tuples: Optional[List[List[List[str]]]] = None,
+) -> Dict[str, Any]:
+    """
+    Builds the record of one sample from the deleted masks of its taus, storing the tree once.
+
+    The nodes deleted for each tau are stored as an index into the distinct lists of deleted breadth first node
+    indices. The map of node names to inclusion is stored as the indices of its nodes, from which the tuples are
+    rebuilt unless they are given.
+
+    Args:
+        sample (dict): The data_ind, pred_str and target_str of the sample, and the value of each tau of the TAU_KEYS
+            and OUTPUT_KEYS it has.
+        tree (dict): The serialized tree of the prediction, without deleted nodes, or None.
+        deleted (np.ndarray): Whether each node is deleted for each tau, of shape (num_taus, num_nodes), in breadth
+            first order.
+        map_inds (List[int], optional): The breadth first indices of the nodes of the map, or None if the outputs have
+            no map. Defaults to None.
+        tuples (list, optional): The tuples of each tau, when they hold more than the map, like those of z3. Defaults
+            to None.
+
+    Returns:
+        dict: The compressed record of the sample.
+    """
+    deleted_lists = []
+    deleted_ind = []
+    map_deleted_to_ind = {}
+    for mask in np.asarray(deleted, dtype=bool):
+        curr = mask.tobytes()
+        # neighbouring taus usually delete the same nodes, so every set is stored once
+        if curr not in map_deleted_to_ind:
+            map_deleted_to_ind[curr] = len(deleted_lists)
+            deleted_lists.append(np.flatnonzero(mask).tolist())
+        deleted_ind.append(map_deleted_to_ind[curr])
+    compressed = {
+        "data_ind": sample["data_ind"],
+        "pred_str": sample["pred_str"],
+        "target_str": sample["target_str"],
+        "tree": tree,
+        "deleted": deleted_lists,
+        "deleted_ind": deleted_ind,
+    }
+    for key in TAU_KEYS + OUTPUT_KEYS:
+        if key in sample:
+            compressed[key] = sample[key]
+    if map_inds is not None:
+        compressed["map_inds"] = map_inds
+    if tuples is not None:
+        compressed["tuples"] = tuples
+    return compressed
+
+
+def prune_tree_json(
+    tree_json: Optional[Dict[str, Any]], deleted: List[int]
+) -> Optional[Dict[str, Any]]:
+    """
+    Creates the serialized entire tree and pruned tree of a tau from the shared tree.
+
+    Args:
+        tree_json (dict): The serialized shared tree, or None.
+        deleted (List[int]): The breadth first indices of the deleted nodes.
+
+    Returns:
+        dict: The serialized pruned root and entire tree with deleted nodes.
+    """
+    if tree_json is None:
+        return {"pruned_root": None, "entire_tree_with_deleted": None}
+    deleted = set(deleted)
+    entire_root = {"children": []}
+    pruned_root = {"children": []}
+    ind = 0
+    q = deque([(tree_json, entire_root, pruned_root)])
+    while len(q) > 0:
+        curr, entire_parent, pruned_parent = q.popleft()
+        attributes = {key: curr[key] for key in curr if key != "children"}
+        if ind in deleted:
+            attributes["deleted"] = True
+        entire_node = dict(attributes, children=[])
+        entire_parent["children"].append(entire_node)
+        # children of a deleted node are attached to a detached node, as in create_tree
+        pruned_node = dict(attributes, children=[])
+        if ind not in deleted:
+            pruned_parent["children"].append(pruned_node)
+        for c in curr["children"]:
+            q.append((c, entire_node, pruned_node))
+        ind += 1
+    return {
+        "pruned_root": (
+            pruned_root["children"][0] if len(pruned_root["children"]) > 0 else None
+        ),
+        "entire_tree_with_deleted": entire_root["children"][0],
+    }
+
+
+def expand_sample_output(compressed: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Rebuilds the per-tau records of one sample from its compressed record.
+
+    Args:
+        compressed (dict): The compressed record of the sample, as returned by build_sample_output.
+
+    Yields:
+        dict: The record of each tau, keyed like the records of optimize_runner.process_sample.
+    """
+    names = None
+    if "map_inds" in compressed:
+        nodes = bfs_json_nodes(compressed["tree"])
+        names = [(i, nodes[i]["code"] + "::" + str(i)) for i in compressed["map_inds"]]
+    for j, deleted_ind in enumerate(compressed["deleted_ind"]):
+        deleted = compressed["deleted"][deleted_ind]
+        record = {key: compressed[key][j] for key in TAU_KEYS}
+        record["pred_str"] = compressed["pred_str"]
+        record["target_str"] = compressed["target_str"]
+        record["data_ind"] = compressed["data_ind"]
+        record["output"] = {
+            key: compressed[key][j] for key in OUTPUT_KEYS if key in compressed
+        }
+        record["output"].update(prune_tree_json(compressed["tree"], deleted))
+        if names is not None:
+            deleted_set = set(deleted)
+            record["output"]["map"] = {name: i not in deleted_set for i, name in names}
+            record["output"]["tuples"] = (
+                compressed["tuples"][j]
+                if "tuples" in compressed
+                else [[name, str(i not in deleted_set)] for i, name in names]
+            )
+        yield record
@@ -0,0 +1,572 @@
+from collections import deque
+import hashlib
+import os
+import sys
+import numpy as np
+from typing import List, Optional, Dict, Union, Any
+
+BASE_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+
+import ast_helper
+
+
+def csr_gather(offsets: np.ndarray, inds: np.ndarray) -> np.ndarray:
+    """
+    Gathers the flat positions of the rows of a compressed sparse row (CSR) layout.
+
+    Args:
+        offsets (np.ndarray): The row offsets, of length num_rows + 1.
+        inds (np.ndarray): The rows to gather.
+
+    Returns:
+        np.ndarray: The flat positions of the gathered rows, in order.
+    """
+    lengths = offsets[inds + 1] - offsets[inds]
+    row_starts = np.repeat(offsets[inds], lengths)
+    within_row = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    return row_starts + within_row
+
+
+def lengths_to_offsets(lengths: List[int]) -> np.ndarray:
+    """
+    Converts row lengths into compressed sparse row (CSR) offsets.
+
+    Args:
+        lengths (List[int]): The length of each row.
+
+    Returns:
+        np.ndarray: The row offsets, of length len(lengths) + 1.
+    """
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum(lengths)
+    return offsets
+
+
+class CompactTree:
+    """
+    A struct-of-arrays representation of an abstract syntax tree (AST) of Nodes.
+
+    Nodes are stored in breadth first order, the order used to number nodes in optimize.py, so the children of a node
+    are contiguous and every level of the tree is contiguous. Variable length attributes are stored in compressed
+    sparse row (CSR) layout.
+
+    Attributes:
+        code (str): The code of the root node.
+        parent (np.ndarray): The index of the parent of each node, or -1 for the root.
+        child_offsets (np.ndarray): The children of node i are the nodes child_offsets[i] to child_offsets[i + 1].
+        depth (np.ndarray): The depth of each node.
+        level_offsets (np.ndarray): The nodes at depth d are the nodes level_offsets[d] to level_offsets[d + 1].
+        start (np.ndarray): The start index of the code of each node in the code of the root node.
+        end (np.ndarray): The end index of the code of each node in the code of the root node.
+        interval_offsets (np.ndarray): The CSR offsets of the intervals of each node.
+        intervals (np.ndarray): The intervals of all nodes, of shape (num_intervals, 2).
+        token_offsets (np.ndarray): The CSR offsets of the tokens and log probabilities of each node.
+        tokens (list): The tokens of all nodes.
+        logprobs (np.ndarray): The log probabilities of all tokens.
+        nll (np.ndarray): The negative log likelihood of each node, or nan if it has none.
+        deleted (np.ndarray): Whether each node is deleted.
+        codes (list): The code of each node, or None if it is the slice of the root code between start and end.
+    """
+
+    def __init__(
+        self,
+        code: str,
+        parent: np.ndarray,
+        child_offsets: np.ndarray,
+        depth: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        interval_offsets: np.ndarray,
+        intervals: np.ndarray,
+        token_offsets: np.ndarray,
+        tokens: List[str],
+        logprobs: np.ndarray,
+        nll: np.ndarray,
+        deleted: np.ndarray,
+        codes: Optional[List[str]] = None,
+    ):
+        self.code = code
+        self.parent = parent
+        self.child_offsets = child_offsets
+        self.depth = depth
+        self.level_offsets = np.searchsorted(
+            depth, np.arange(depth.max() + 2 if len(depth) > 0 else 1)
+        ).astype(np.int32)
+        self.start = start
+        self.end = end
+        self.interval_offsets = interval_offsets
+        self.intervals = intervals
+        self.token_offsets = token_offsets
+        self.tokens = tokens
+        self.logprobs = logprobs
+        self.nll = nll
+        self.deleted = deleted
+        self.codes = codes
+        self._interval_strings = None
+        self._subtree_hashes = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __str__(self):
+        return str(self.to_node())
+
+    @classmethod
+    def from_node(cls, root: ast_helper.Node) -> "CompactTree":
+        """
+        Creates a compact tree from a tree of Nodes.
+
+        Args:
+            root (Node): The root node of the tree.
+
+        Returns:
+            CompactTree: The compact tree.
+        """
+        nodes = []
+        parent = []
+        depth = []
+        q = deque()
+        q.append((root, -1, 0))
+        while len(q) > 0:
+            curr, curr_parent, curr_depth = q.popleft()
+            curr_ind = len(nodes)
+            nodes.append(curr)
+            parent.append(curr_parent)
+            depth.append(curr_depth)
+            for c in curr.children:
+                q.append((c, curr_ind, curr_depth + 1))
+        codes = [n.code for n in nodes]
+        derived = all([root.code[n.start : n.end] == n.code for n in nodes])
+        intervals = [tuple(t) for n in nodes for t in n.intervals]
+        return cls(
+            code=root.code,
+            parent=np.array(parent, dtype=np.int32),
+            child_offsets=lengths_to_offsets([len(n.children) for n in nodes]) + 1,
+            depth=np.array(depth, dtype=np.int32),
+            start=np.array([n.start for n in nodes], dtype=np.int32),
+            end=np.array([n.end for n in nodes], dtype=np.int32),
+            interval_offsets=lengths_to_offsets([len(n.intervals) for n in nodes]),
+            intervals=np.array(intervals, dtype=np.int32).reshape(-1, 2),
+            token_offsets=lengths_to_offsets([len(n.tokens) for n in nodes]),
+            tokens=[t for n in nodes for t in n.tokens],
+            logprobs=np.array([p for n in nodes for p in n.logprobs], dtype=float),
+            nll=np.array(
+                [np.nan if n.nll is None else n.nll for n in nodes], dtype=float
+            ),
+            deleted=np.array([bool(n.deleted) for n in nodes], dtype=bool),
+            codes=None if derived else codes,
+        )
+
+    def node_code(self, i: int) -> str:
+        """
+        Returns the code of the given node.
+
+        Args:
+            i (int): The index of the node.
+
+        Returns:
+            str: The code of the node.
+        """
+        if self.codes is not None:
+            return self.codes[i]
+        return self.code[self.start[i] : self.end[i]]
+
+    def children(self, i: int) -> range:
+        """
+        Returns the indices of the children of the given node.
+
+        Args:
+            i (int): The index of the node.
+
+        Returns:
+            range: The indices of the children of the node.
+        """
+        return range(self.child_offsets[i], self.child_offsets[i + 1])
+
+    def node_intervals(self, i: int) -> List[List[int]]:
+        """
+        Returns the intervals of the given node.
+
+        Args:
+            i (int): The index of the node.
+
+        Returns:
+            list: The intervals of the node.
+        """
+        return self.intervals[
+            self.interval_offsets[i] : self.interval_offsets[i + 1]
+        ].tolist()
+
+    def node_dict(self, i: int) -> Dict[str, Any]:
+        """
+        Returns the attributes of the given node, without its children.
+
+        Args:
+            i (int): The index of the node.
+
+        Returns:
+            dict: The attributes of the node, keyed like Node.toJSON.
+        """
+        token_slice = slice(self.token_offsets[i], self.token_offsets[i + 1])
+        return {
+            "code": self.node_code(i),
+            "start": int(self.start[i]),
+            "end": int(self.end[i]),
+            "intervals": self.node_intervals(i),
+            "tokens": self.tokens[token_slice],
+            "logprobs": self.logprobs[token_slice].tolist(),
+            "nll": None if np.isnan(self.nll[i]) else float(self.nll[i]),
+            "deleted": bool(self.deleted[i]),
+        }
+
+    def to_node(self) -> ast_helper.Node:
+        """
+        Creates a tree of Nodes from the compact tree.
+
+        Returns:
+            Node: The root node of the tree.
+        """
+        nodes = []
+        for i in range(len(self)):
+            attributes = self.node_dict(i)
+            n = ast_helper.Node(attributes.pop("code"))
+            for key in attributes:
+                setattr(n, key, attributes[key])
+            n.intervals = [tuple(t) for t in n.intervals]
+            n.colon_name = n.code + "::" + str(i)
+            nodes.append(n)
+            if self.parent[i] >= 0:
+                nodes[self.parent[i]].children.append(n)
+        return nodes[0]
+
+    def toJSON(self) -> Dict[str, Any]:
+        """
+        Serializes the compact tree into the nested dictionary of Node.toJSON.
+
+        Returns:
+            dict: The serialized root node.
+        """
+        serialized = [None] * len(self)
+        for i in range(len(self) - 1, -1, -1):
+            serialized[i] = self.node_dict(i)
+            serialized[i]["children"] = [serialized[c] for c in self.children(i)]
+        return serialized[0]
+
+    def copy(self) -> "CompactTree":
+        """
+        Creates a copy of the compact tree that shares every array except the deleted mask.
+
+        Returns:
+            CompactTree: The copy of the compact tree.
+        """
+        return self.with_deleted(self.deleted.copy())
+
+    def with_deleted(self, deleted: np.ndarray) -> "CompactTree":
+        """
+        Creates a view of the compact tree with the given deleted mask.
+
+        Args:
+            deleted (np.ndarray): Whether each node is deleted.
+
+        Returns:
+            CompactTree: The compact tree with the deleted mask.
+        """
+        tree = CompactTree.__new__(CompactTree)
+        tree.__dict__.update(self.__dict__)
+        tree.deleted = deleted
+        # the subtree hashes skip deleted children, so they depend on the mask
+        tree._subtree_hashes = None
+        return tree
+
+    def removed(self) -> np.ndarray:
+        """
+        Computes which nodes are deleted or have a deleted ancestor, one level of the tree at a time.
+
+        Returns:
+            np.ndarray: Whether each node is removed.
+        """
+        removed = self.deleted.copy()
+        for d in range(1, len(self.level_offsets) - 1):
+            level = slice(self.level_offsets[d], self.level_offsets[d + 1])
+            removed[level] |= removed[self.parent[level]]
+        return removed
+
+    def num_holes(self) -> int:
+        """
+        Calculates the number of deleted holes in the tree, like optimize_greedy.calculate_m.
+
+        Returns:
+            int: The number of deleted nodes without a removed ancestor.
+        """
+        removed = self.removed()
+        parent_removed = np.concatenate([[False], removed[self.parent[1:]]])
+        return int(np.sum(self.deleted & ~parent_removed))
+
+    def num_not_deleted(self) -> int:
+        """
+        Calculates the number of nodes that are not removed.
+
+        Returns:
+            int: The number of nodes without a deleted ancestor that are not deleted.
+        """
+        return int(np.sum(~self.removed()))
+
+    def error_of_tree_undeleted(self) -> float:
+        """
+        Calculates the total error of the nodes that are not removed.
+
+        Returns:
+            float: The total negative log likelihood of the nodes that are not removed.
+        """
+        return float(np.nansum(self.nll[~self.removed()]))
+
+    def subtree_costs(self) -> np.ndarray:
+        """
+        Computes the total negative log likelihood of the subtree of each node, one level of the tree at a time.
+
+        Returns:
+            np.ndarray: The subtree cost of each node.
+        """
+        costs = np.nan_to_num(self.nll).copy()
+        for d in range(len(self.level_offsets) - 2, 0, -1):
+            level = np.arange(self.level_offsets[d], self.level_offsets[d + 1])
+            np.add.at(costs, self.parent[level], costs[level])
+        return costs
+
+    def pruned(self) -> Optional["CompactTree"]:
+        """
+        Creates a new compact tree without the removed nodes, like optimize_greedy.rm_deleted_nodes.
+
+        Returns:
+            CompactTree: The pruned tree, or None if the root is deleted.
+        """
+        keep = np.flatnonzero(~self.removed())
+        if len(keep) == 0 or keep[0] != 0:
+            return None
+        new_index = np.full(len(self), -1, dtype=np.int32)
+        new_index[keep] = np.arange(len(keep), dtype=np.int32)
+        parent = np.where(
+            self.parent[keep] >= 0, new_index[self.parent[keep]], -1
+        ).astype(np.int32)
+        num_children = np.bincount(parent[1:], minlength=len(keep))
+        interval_inds = csr_gather(self.interval_offsets, keep)
+        token_inds = csr_gather(self.token_offsets, keep)
+        return CompactTree(
+            code=self.code,
+            parent=parent,
+            child_offsets=lengths_to_offsets(num_children) + 1,
+            depth=self.depth[keep],
+            start=self.start[keep],
+            end=self.end[keep],
+            interval_offsets=lengths_to_offsets(
+                self.interval_offsets[keep + 1] - self.interval_offsets[keep]
+            ),
+            intervals=self.intervals[interval_inds],
+            token_offsets=lengths_to_offsets(
+                self.token_offsets[keep + 1] - self.token_offsets[keep]
+            ),
+            tokens=[self.tokens[t] for t in token_inds],
+            logprobs=self.logprobs[token_inds],
+            nll=self.nll[keep],
+            deleted=self.deleted[keep],
+            codes=None if self.codes is None else [self.codes[i] for i in keep],
+        )
+
+    def interval_strings(self) -> List[str]:
+        """
+        Computes the code of the intervals of each node, joined by "#", as used by optimize_runner.is_subtree.
+
+        Returns:
+            list: The interval string of each node.
+        """
+        if self._interval_strings is None:
+            bounds = self.intervals.tolist()
+            self._interval_strings = [
+                "#".join(
+                    [
+                        self.code[t[0] : t[1]]
+                        for t in bounds[
+                            self.interval_offsets[i] : self.interval_offsets[i + 1]
+                        ]
+                    ]
+                )
+                for i in range(len(self))
+            ]
+        return self._interval_strings
+
+    def subtree_hashes(self) -> List[bytes]:
+        """
+        Computes a Merkle hash of the subtree of each node from its interval string and the hashes of its children that
+        are not deleted, bottom up in reverse breadth first order.
+
+        Two subtrees with the same hash have the same interval strings in the same shape, so one is a subtree of the
+        other without comparing their descendants.
+
+        Returns:
+            list: The hash of the subtree of each node.
+        """
+        if self._subtree_hashes is None:
+            strings = self.interval_strings()
+            hashes = [None] * len(self)
+            for i in range(len(self) - 1, -1, -1):
+                curr = strings[i].encode()
+                h = hashlib.blake2b(
+                    str(len(curr)).encode() + b":" + curr, digest_size=16
+                )
+                for c in self.children(i):
+                    if not self.deleted[c]:
+                        h.update(hashes[c])
+                hashes[i] = h.digest()
+            self._subtree_hashes = hashes
+        return self._subtree_hashes
+
+
+def deleted_masks(roots: List[Optional[ast_helper.Node]]) -> np.ndarray:
+    """
+    Stacks the deleted flags of trees with the same shape, such as the entire trees with deleted nodes of every tau.
+
+    Args:
+        roots (List[Node]): The root nodes of the trees.
+
+    Returns:
+        np.ndarray: Whether each node of each tree is deleted, of shape (len(roots), num_nodes), in breadth first order.
+    """
+    masks = []
+    for root in roots:
+        deleted = []
+        q = deque([root] if root is not None else [])
+        while len(q) > 0:
+            curr = q.popleft()
+            deleted.append(bool(curr.deleted))
+            q.extend(curr.children)
+        masks.append(deleted)
+    return np.array(masks, dtype=bool).reshape(len(roots), -1)
+
+
+def is_subtree(
+    target: CompactTree,
+    pruned: Optional[CompactTree],
+    target_ind: int = 0,
+    pruned_ind: int = 0,
+) -> Dict[str, Union[bool, str]]:
+    """
+    Checks if a pruned tree is a subtree of a target tree, like optimize_runner.is_subtree.
+
+    Args:
+        target (CompactTree): The target tree.
+        pruned (CompactTree): The pruned tree, with deleted nodes marked in its deleted mask.
+        target_ind (int, optional): The index of the target node to compare. Defaults to the root.
+        pruned_ind (int, optional): The index of the pruned node to compare. Defaults to the root.
+
+    Returns:
+        dict: A dictionary containing a boolean indicating whether the pruned tree is a subtree of the target tree, and a reason for the result.
+    """
+    if pruned is None:
+        return {"eval": True, "reason": "Pruned is None"}
+    return is_subtree_batch(
+        target, pruned, pruned.deleted[None, :], target_ind, pruned_ind
+    )[0]
+
+
+def is_subtree_batch(
+    target: CompactTree,
+    pruned: Optional[CompactTree],
+    deleted: np.ndarray,
+    target_ind: int = 0,
+    pruned_ind: int = 0,
+) -> List[Dict[str, Union[bool, str]]]:
+    """
+    Checks if each of several deleted masks of a pruned tree gives a subtree of a target tree, in a single walk.
+
+    The masks are walked together and split only where their children differ. A subtree of the pruned tree without
+    deleted nodes whose hash equals the hash of the target subtree is accepted without walking it.
+
+    Args:
+        target (CompactTree): The target tree.
+        pruned (CompactTree): The pruned tree. Its own deleted mask is ignored.
+        deleted (np.ndarray): Whether each node of the pruned tree is deleted, of shape (num_masks, len(pruned)).
+        target_ind (int, optional): The index of the target node to compare. Defaults to the root.
+        pruned_ind (int, optional): The index of the pruned node to compare. Defaults to the root.
+
+    Returns:
+        list: The result of each mask, as returned by is_subtree.
+    """
+    if pruned is None:
+        return [{"eval": True, "reason": "Pruned is None"} for _ in range(len(deleted))]
+    deleted = np.asarray(deleted, dtype=bool)
+    if pruned.deleted.any():
+        pruned = pruned.with_deleted(np.zeros(len(pruned), dtype=bool))
+    # whether each mask deletes a strict descendant of each node, one level of the tree at a time
+    deleted_below = np.zeros(deleted.shape, dtype=bool)
+    for d in range(len(pruned.level_offsets) - 2, 0, -1):
+        level = np.arange(pruned.level_offsets[d], pruned.level_offsets[d + 1])
+        np.logical_or.at(
+            deleted_below.T,
+            pruned.parent[level],
+            (deleted[:, level] | deleted_below[:, level]).T,
+        )
+    target_strings = target.interval_strings()
+    pruned_strings = pruned.interval_strings()
+    target_hashes = target.subtree_hashes()
+    pruned_hashes = pruned.subtree_hashes()
+    target_maps = {}
+    results = [None] * len(deleted)
+
+    def visit(t, p, masks):
+        if target_strings[t] != pruned_strings[p]:
+            reason = (
+                "Curr nodes are not the same: "
+                + str([target.code[i[0] : i[1]] for i in target.node_intervals(t)])
+                + " vs "
+                + str([pruned.code[i[0] : i[1]] for i in pruned.node_intervals(p)])
+            )
+            for j in masks:
+                results[j] = {"eval": False, "reason": reason}
+            return
+        if target_hashes[t] == pruned_hashes[p]:
+            masks = masks[deleted_below[masks, p]]
+        children = np.array(pruned.children(p))
+        if len(masks) == 0 or len(children) == 0:
+            return
+        if t not in target_maps:
+            target_maps[t] = {
+                target_strings[c]: c
+                for c in target.children(t)
+                if not target.deleted[c]
+            }
+        target_map = target_maps[t]
+        rows = deleted[np.ix_(masks, children)]
+        # masks usually agree on the children, which needs no grouping
+        if (rows == rows[0]).all():
+            patterns, inverse = rows[:1], np.zeros(len(masks), dtype=int)
+        else:
+            patterns, inverse = np.unique(rows, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        for g in range(len(patterns)):
+            group = masks[inverse == g]
+            pruned_map = {pruned_strings[c]: c for c in children[~patterns[g]].tolist()}
+            # check if all pruned children are in target children
+            missing = [s for s in pruned_map if s not in target_map]
+            if len(missing) > 0:
+                reason = f"Pred child ({missing[0]}) not in target_children_set ({target_map.keys()})"
+                for j in group:
+                    results[j] = {"eval": False, "reason": reason}
+                continue
+            # check if pruned child node is subtree of relevant target children node
+            for target_child_str in target_map:
+                if target_child_str in pruned_map:
+                    visit(
+                        target_map[target_child_str],
+                        pruned_map[target_child_str],
+                        group,
+                    )
+                    group = group[[results[j] is None for j in group]]
+                    if len(group) == 0:
+                        break
+
+    visit(target_ind, pruned_ind, np.arange(len(deleted)))
+    return [{"eval": True} if r is None else r for r in results]
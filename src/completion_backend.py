@@ -0,0 +1,331 @@
+import os
+import sys
+import re
+import math
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(ROOT_DIR)
+
+from utils import utils
+
+# newlines, words and punctuation with their leading spaces, like the tokens of the completions endpoint
+TOKEN_PATTERN = re.compile(r"\n|[ \t]*\w+|[ \t]*[^\w\s]|[ \t]+")
+# rough number of characters per token, to estimate the tokens of a prompt without a tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text)
+
+
+def estimate_num_tokens(prompt: str, max_tokens: int) -> int:
+    """
+    Estimates the number of prompt and completion tokens of a request.
+
+    Args:
+        prompt (str): The prompt of the request.
+        max_tokens (int): The maximum number of tokens in the generated completion.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(prompt) // CHARS_PER_TOKEN + max_tokens
+
+
+def iter_packed_batches(
+    items: Iterable[Tuple[Any, str]],
+    batch_size: int,
+    token_budget: Optional[int] = None,
+    max_tokens: int = 50,
+) -> Iterator[List[Tuple[Any, str]]]:
+    """
+    Packs keyed prompts, in order, into batches of at most batch_size prompts and token_budget estimated tokens.
+
+    A batch is yielded as soon as the next prompt does not fit in it, so the items may still be arriving. A prompt over
+    the token budget on its own is sent in a batch of its own.
+
+    Args:
+        items (Iterable[tuple]): The key and prompt of each request.
+        batch_size (int): The maximum number of prompts of a batch.
+        token_budget (int, optional): The maximum number of estimated tokens of a batch. Defaults to None.
+        max_tokens (int, optional): The maximum number of tokens in each generated completion. Defaults to 50.
+
+    Yields:
+        list: The key and prompt of each request of a batch.
+    """
+    batch = []
+    batch_tokens = 0
+    for key, prompt in items:
+        num_tokens = estimate_num_tokens(prompt, max_tokens)
+        if len(batch) > 0 and (
+            len(batch) >= batch_size
+            or (token_budget is not None and batch_tokens + num_tokens > token_budget)
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((key, prompt))
+        batch_tokens += num_tokens
+    if len(batch) > 0:
+        yield batch
+
+
+def pack_prompts(
+    prompts: List[str],
+    batch_size: int,
+    token_budget: Optional[int] = None,
+    max_tokens: int = 50,
+) -> List[List[int]]:
+    """
+    Packs prompts, in order, into batches with iter_packed_batches.
+
+    Args:
+        prompts (List[str]): The prompts to pack.
+        batch_size (int): The maximum number of prompts of a batch.
+        token_budget (int, optional): The maximum number of estimated tokens of a batch. Defaults to None.
+        max_tokens (int, optional): The maximum number of tokens in each generated completion. Defaults to 50.
+
+    Returns:
+        list: The indices of the prompts of each batch.
+    """
+    return [
+        [i for i, _ in batch]
+        for batch in iter_packed_batches(
+            enumerate(prompts), batch_size, token_budget, max_tokens
+        )
+    ]
+
+
+class CompletionBackend(ABC):
+    """
+    A source of completions with token log probabilities, in the response shape of codex_interface.get_evaluation.
+
+    Subclasses implement get_evaluation; the batched and asynchronous variants default to calling it.
+
+    Attributes:
+        remote (bool): Whether requests go over the network and count against a quota.
+    """
+
+    remote = False
+
+    @property
+    def rate_limit_errors(self) -> Tuple[Type[Exception], ...]:
+        """
+        The exceptions raised when a request is rejected for exceeding the rate limit, and should be retried.
+        """
+        return ()
+
+    @abstractmethod
+    def get_evaluation(
+        self,
+        prompt: str,
+        logprobs: int = 1,
+        max_tokens: int = 50,
+        model: str = "code-davinci-002",
+    ) -> Dict[str, Any]:
+        pass
+
+    def get_evaluation_batch(
+        self,
+        prompts: List[str],
+        logprobs: int = 1,
+        max_tokens: int = 50,
+        model: str = "code-davinci-002",
+    ) -> List[Dict[str, Any]]:
+        return [
+            self.get_evaluation(
+                p, logprobs=logprobs, max_tokens=max_tokens, model=model
+            )
+            for p in prompts
+        ]
+
+    async def get_evaluation_async(
+        self,
+        prompt: str,
+        logprobs: int = 1,
+        max_tokens: int = 50,
+        model: str = "code-davinci-002",
+    ) -> Dict[str, Any]:
+        return self.get_evaluation(
+            prompt, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+    async def get_evaluation_batch_async(
+        self,
+        prompts: List[str],
+        logprobs: int = 1,
+        max_tokens: int = 50,
+        model: str = "code-davinci-002",
+    ) -> List[Dict[str, Any]]:
+        return self.get_evaluation_batch(
+            prompts, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+
+class OpenAIBackend(CompletionBackend):
+    """
+    The completions endpoint, through codex_interface.
+    """
+
+    remote = True
+
+    @property
+    def rate_limit_errors(self):
+        import codex_interface
+
+        return (codex_interface.openai.error.RateLimitError,)
+
+    def get_evaluation(
+        self, prompt, logprobs=1, max_tokens=50, model="code-davinci-002"
+    ):
+        import codex_interface
+
+        return codex_interface.get_evaluation(
+            prompt, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+    def get_evaluation_batch(
+        self, prompts, logprobs=1, max_tokens=50, model="code-davinci-002"
+    ):
+        import codex_interface
+
+        return codex_interface.get_evaluation_batch(
+            prompts, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+    async def get_evaluation_async(
+        self, prompt, logprobs=1, max_tokens=50, model="code-davinci-002"
+    ):
+        import codex_interface
+
+        return await codex_interface.get_evaluation_async(
+            prompt, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+    async def get_evaluation_batch_async(
+        self, prompts, logprobs=1, max_tokens=50, model="code-davinci-002"
+    ):
+        import codex_interface
+
+        return await codex_interface.get_evaluation_batch_async(
+            prompts, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+
+class ReplayBackend(CompletionBackend):
+    """
+    Replays the responses stored by inference.log_inference, looked up by their prompt.
+
+    Attributes:
+        responses (dict): The stored response of each prompt.
+        fallback (CompletionBackend): The backend of prompts without a stored response, or None to raise KeyError.
+    """
+
+    def __init__(
+        self, directories: List[str], fallback: Optional[CompletionBackend] = None
+    ):
+        self.responses = {}
+        self.fallback = fallback
+        for directory in directories:
+            for file in sorted(os.listdir(directory)):
+                data = utils.read_json(os.path.join(directory, file))
+                self.responses[data["prompt"]["prompt"]] = data["response"]
+
+    def get_evaluation(
+        self, prompt, logprobs=1, max_tokens=50, model="code-davinci-002"
+    ):
+        if prompt in self.responses:
+            return self.responses[prompt]
+        if self.fallback is None:
+            raise KeyError(f"no stored response for prompt {prompt[-50:]!r}")
+        return self.fallback.get_evaluation(
+            prompt, logprobs=logprobs, max_tokens=max_tokens, model=model
+        )
+
+
+class NGramBackend(CompletionBackend):
+    """
+    A deterministic n-gram model of tokens, with add-one smoothing and backoff to shorter contexts.
+
+    Completions are decoded greedily, like temperature 0, for max_tokens tokens, as requests have no stop sequence.
+
+    Attributes:
+        n (int): The order of the model.
+        counts (dict): The next token counts of each context of up to n - 1 tokens.
+        vocab (list): The tokens of the corpus, sorted so that ties are broken deterministically.
+    """
+
+    def __init__(self, corpus: List[str], n: int = 3):
+        self.n = n
+        self.counts = defaultdict(lambda: defaultdict(int))
+        vocab = set(["\n"])
+        for text in corpus:
+            tokens = tokenize(text)
+            vocab.update(tokens)
+            for i in range(len(tokens)):
+                for order in range(n):
+                    if i - order < 0:
+                        break
+                    self.counts[tuple(tokens[i - order : i])][tokens[i]] += 1
+        self.vocab = sorted(vocab)
+
+    def next_token_logprobs(self, context: List[str]) -> Dict[str, float]:
+        """
+        Computes the log probability of every token of the vocabulary after the longest seen suffix of the context.
+
+        Args:
+            context (List[str]): The previous tokens.
+
+        Returns:
+            dict: The log probability of each token.
+        """
+        # without a corpus no context is seen, and every token is equally likely
+        counts = {}
+        for order in range(self.n - 1, -1, -1):
+            key = tuple(context[len(context) - order :]) if order > 0 else ()
+            if len(context) >= order and key in self.counts:
+                counts = self.counts[key]
+                break
+        total = sum(counts.values()) + len(self.vocab)
+        return {t: math.log((counts.get(t, 0) + 1) / total) for t in self.vocab}
+
+    def get_evaluation(
+        self, prompt, logprobs=1, max_tokens=50, model="code-davinci-002"
+    ):
+        context = tokenize(prompt)
+        tokens = []
+        token_logprobs = []
+        top_logprobs = []
+        text_offset = []
+        offset = len(prompt)
+        for _ in range(max_tokens):
+            scores = self.next_token_logprobs(context)
+            ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+            token, logprob = ranked[0]
+            tokens.append(token)
+            token_logprobs.append(logprob)
+            top_logprobs.append(dict(ranked[:logprobs]))
+            text_offset.append(offset)
+            offset += len(token)
+            context.append(token)
+        return {
+            "object": "text_completion",
+            "model": f"ngram-{self.n}",
+            "choices": [
+                {
+                    "text": "".join(tokens),
+                    "index": 0,
+                    "logprobs": {
+                        "tokens": tokens,
+                        "token_logprobs": token_logprobs,
+                        "top_logprobs": top_logprobs,
+                        "text_offset": text_offset,
+                    },
+                    "finish_reason": "length",
+                }
+            ],
+        }
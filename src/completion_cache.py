@@ -0,0 +1,165 @@
+import functools
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class CompletionCache:
+    """
+    A content addressed cache of model completions, stored in a single SQLite file.
+
+    Completions are keyed by a hash of the full request. When the stored completions exceed the maximum size, the
+    least recently used ones are evicted.
+
+    Attributes:
+        path (str): The path of the cache file.
+        max_bytes (int): The maximum total size of the stored completions, or None for no limit.
+        read_only (bool): Whether the cache only serves stored completions, for reproducible experiments.
+        hits (int): The number of requests served from the cache.
+        misses (int): The number of requests not in the cache.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: Optional[int] = None, read_only: bool = False
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)"
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def request_key(**request: Any) -> str:
+        """
+        Hashes a request into its cache key.
+
+        Args:
+            **request: The arguments of the request.
+
+        Returns:
+            str: The hex digest of the canonical JSON of the request.
+        """
+        return hashlib.sha256(
+            json.dumps(request, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up a completion and counts the hit or miss.
+
+        Args:
+            key (str): The cache key of the request.
+
+        Returns:
+            dict: The stored completion, or None if it is not in the cache.
+        """
+        row = self.conn.execute(
+            "SELECT value FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not self.read_only:
+            self.conn.execute(
+                "UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """
+        Stores a completion, then evicts the least recently used completions above the maximum size.
+
+        Args:
+            key (str): The cache key of the request.
+            value (dict): The completion.
+        """
+        if self.read_only:
+            raise PermissionError(f"cache {self.path} is read only")
+        value_str = json.dumps(value)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+            (key, value_str, len(value_str), time.time()),
+        )
+        if self.max_bytes is not None:
+            total = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in self.conn.execute(
+                    "SELECT key, size FROM completions ORDER BY last_used"
+                ).fetchall():
+                    if total <= self.max_bytes or old_key == key:
+                        break
+                    self.conn.execute(
+                        "DELETE FROM completions WHERE key = ?", (old_key,)
+                    )
+                    total -= size
+        self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit and miss counts of the cache.
+
+        Returns:
+            dict: The number of hits and misses.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up a completion, failing on a miss in read only mode instead of letting the request through.
+
+        Args:
+            key (str): The cache key of the request.
+
+        Returns:
+            dict: The stored completion, or None if it is not in the cache.
+        """
+        value = self.get(key)
+        if value is None and self.read_only:
+            raise KeyError(f"request {key} is not in read only cache {self.path}")
+        return value
+
+    def wrap(self, get_evaluation: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Wraps codex_interface.get_evaluation so that every request is served from the cache when possible.
+
+        Args:
+            get_evaluation (Callable): The function generating a completion.
+
+        Returns:
+            Callable: The cached function, with the same arguments.
+        """
+
+        @functools.wraps(get_evaluation)
+        def cached(
+            prompt: str,
+            logprobs: int = 1,
+            max_tokens: int = 50,
+            model: str = "code-davinci-002",
+        ):
+            key = self.request_key(
+                prompt=prompt, logprobs=logprobs, max_tokens=max_tokens, model=model
+            )
+            value = self.lookup(key)
+            if value is None:
+                value = get_evaluation(
+                    prompt, logprobs=logprobs, max_tokens=max_tokens, model=model
+                )
+                self.put(key, value)
+            return value
+
+        return cached
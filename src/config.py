@@ -0,0 +1,23 @@
+import os
+
+# paths on the original machine, each overridden by the environment variable of the same name with a PAC_ prefix
+DEFAULTS = {
+    "HUMANEVAL_PATH": "/home/akhakhar/data/human_eval/HumanEval.jsonl",
+    "APPS_PATH": "/home/akhakhar/data/APPS/test/",
+    "APPS_PACK_PATH": "/home/akhakhar/data/APPS/test.pack",
+    "OUTPUT_PATH": "/home/akhakhar/shared/code-davinci",
+    "OPEN_AI_KEY_PATH": "/home/akhakhar/keys/OPEN_AI_API_KEY",
+}
+
+
+def get(name: str) -> str:
+    """
+    Returns a configured path.
+
+    Args:
+        name (str): The name of the path, one of the keys of DEFAULTS.
+
+    Returns:
+        str: The value of the environment variable PAC_<name>, or the default path.
+    """
+    return os.environ.get("PAC_" + name, DEFAULTS[name])
@@ -1,15 +1,15 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
-from typing import List
-import ipdb
+import inspect
+import argparse
+from typing import Any, Dict, List
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(ROOT_DIR)
 sys.path.append(BASE_DIR)
-from pac import compute_k
+import aggregate
 from utils import utils
 
 
@@ -22,6 +22,9 @@ def create_plot_from_fn(
     ylabel=None,
     title=None,
 ):
+    # matplotlib is only imported when plotting, so the aggregation can be used without it
+    import matplotlib.pyplot as plt
+
     _, ax = plt.subplots()
     plt.plot(x, y)
     ax.spines["right"].set_color((0.8, 0.8, 0.8))
@@ -66,6 +69,8 @@ def plot_multiple_series(
     if line_width is None:
         line_width = [1] * len(x)
     assert len(x) == len(line_width)
+    import matplotlib.pyplot as plt
+
     _, ax = plt.subplots()
 
     for i in range(len(x)):
@@ -102,79 +107,87 @@ def plot_multiple_series(
     plt.savefig(f"{save_path}/{save_title}", bbox_inches="tight", transparent=False)
 
 
+def load_figure_fingerprints(path: str) -> Dict[str, str]:
+    """
+    Reads the fingerprint of the inputs and configuration of each figure, as of when it was last created.
+
+    Args:
+        path (str): The path of the fingerprints.
+
+    Returns:
+        dict: The fingerprint of each figure, by save title.
+    """
+    if not os.path.exists(path):
+        return {}
+    return utils.read_json(path)
+
+
+def figure_fingerprint(inputs: List[str], config: Dict[str, Any]) -> str:
+    """
+    Fingerprints a figure from the fingerprints of its curves, its configuration and the plotting code, so that
+    editing the style of the figures also recreates them.
+
+    Args:
+        inputs (List[str]): The fingerprint of the outputs of each curve, as returned by aggregate.load_curves.
+        config (dict): The configuration of the figure.
+
+    Returns:
+        str: The fingerprint of the figure.
+    """
+    return aggregate.fingerprint(
+        {
+            "inputs": inputs,
+            "config": config,
+            "code": inspect.getsource(plot_multiple_series),
+        }
+    )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-m", dest="max_m", type=int, default=4)
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=str,
+        default=f"{ROOT_DIR}/results/plot_cache",
+        help="curves and figure fingerprints of previous runs",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="recompute every curve and recreate every figure",
+    )
+    args = parser.parse_args()
+
     # FROM DATA METHOD
     d = 0.1
     computed = []
-    max_m = 4
+    max_m = args.max_m
+    e = np.linspace(0.03, 0.65, num=50)
+    # the curves of an m are only recomputed when one of its outputs changed size or modification time
+    inputs = []
     for m in range(1, max_m + 1):
         print("m", m, flush=True)
-        data = []
-        for q in range(90):
-            print(q, flush=True)
-            try:
-                data += utils.read_json(
-                    f"{ROOT_DIR}/results/optimize_output_ind_{q}__m_{m}.json"
-                )["output"]
-            except:
-                pass
-        print("retrieved data", len(data))
-        map_tau_to_target_in_pruned_pred = {}
-        map_tau_to_frac_rm = {}
-        for sample in data:
-            tau = np.exp(-1 * sample["cost"])
-            if tau not in map_tau_to_target_in_pruned_pred:
-                map_tau_to_target_in_pruned_pred[tau] = (0, 0)
-                map_tau_to_frac_rm[tau] = []
-            prev_cnt_sum = map_tau_to_target_in_pruned_pred[tau]
-            # print("sample["target_in_pruned_pred"][0]", sample["target_in_pruned_pred"][0])
-            map_tau_to_target_in_pruned_pred[tau] = (
-                prev_cnt_sum[0] + int(sample["pred_in_target"]["eval"]),
-                prev_cnt_sum[1] + 1,
-            )
-            map_tau_to_frac_rm[tau].append(sample["output"]["frac_included"])
-        taus_lst = []
-        coverage_lst = []
-        frac_rm_lst = []
-        n = -1
-        for key in map_tau_to_target_in_pruned_pred:
-            val = map_tau_to_target_in_pruned_pred[key]
-            taus_lst.append(key)
-            coverage_lst.append(val[0] / val[1] * 100)
-            frac_rm_lst.append(100 - np.mean(map_tau_to_frac_rm[key]) * 100)
-            n = val[1]
-        assert len(taus_lst) == len(coverage_lst)
-        assert len(taus_lst) == len(coverage_lst)
-        assert len(taus_lst) == len(frac_rm_lst)
-
+        curves, inputs_fingerprint = aggregate.load_curves(
+            m, cache_dir=args.cache_dir, refresh=args.force
+        )
+        inputs.append(inputs_fingerprint)
+        print("retrieved data", int(np.sum(curves["counts"])))
         # map data to e space
-        e = np.linspace(0.03, 0.65, num=50).tolist()
-        target_coverage = []
-        for i in range(len(e)):
-            print(n, e[i], d)
-            target_coverage.append(100 - compute_k(n, e[i], d) / n * 100)
-
-        e_to_taus_lst = []
-        e_to_coverage_lst = []
-        e_to_frac_rm_lst = []
-        for i in range(len(e)):
-            for j in range(len(taus_lst)):
-                if coverage_lst[j] >= target_coverage[i]:
-                    e_to_taus_lst.append(taus_lst[j])
-                    e_to_coverage_lst.append(coverage_lst[j])
-                    e_to_frac_rm_lst.append(frac_rm_lst[j])
-                    break
-        print("e", e)
-        print("target_coverage", target_coverage)
-        print("e_to_taus_lst", e_to_taus_lst)
-        print("e_to_coverage_lst", e_to_coverage_lst)
-        print("e_to_frac_rm_lst", e_to_frac_rm_lst)
+        mapped = aggregate.map_e_to_taus(curves, e, d)
+        print(mapped["n"], d)
+        print("e", e.tolist())
+        print("target_coverage", mapped["target_coverage"].tolist())
+        print("e_to_taus_lst", mapped["taus"].tolist())
+        print("e_to_coverage_lst", mapped["coverage"].tolist())
+        print("e_to_frac_rm_lst", mapped["frac_rm"].tolist())
         computed.append(
             {
-                "e": e,
-                "taus": e_to_taus_lst,
-                "percent_nodes_removed": e_to_frac_rm_lst,
-                "target_in_set": e_to_coverage_lst,
+                "e": e.tolist(),
+                "taus": mapped["taus"].tolist(),
+                "percent_nodes_removed": mapped["frac_rm"].tolist(),
+                "target_in_set": mapped["coverage"].tolist(),
                 "label": f"m={m}",
                 "m": m,
                 "linestyle": "-",
@@ -184,14 +197,17 @@ if __name__ == "__main__":
 
     computed.append(
         {
-            "e": e,
-            "target_in_set": [100 - e_i * 100 for e_i in e],
+            "e": e.tolist(),
+            "target_in_set": [100 - e_i * 100 for e_i in e.tolist()],
             "label": "Target Bound",
             "linestyle": "--",
             "color": "black",
         }
     )
     os.makedirs(f"{ROOT_DIR}/output/", exist_ok=True)
+    os.makedirs(args.cache_dir, exist_ok=True)
+    fingerprints_path = f"{args.cache_dir}/figures.json"
+    fingerprints = {} if args.force else load_figure_fingerprints(fingerprints_path)
     linewidths = list(range(1, 2 * (max_m + 1), 2))
     for key, y_label, title in [
         # ("taus", r"$\tau$", r"Satisfying $\tau$ For Given $\epsilon$"),
@@ -206,6 +222,26 @@ if __name__ == "__main__":
             r"Percent Code Set Coverage Over $\epsilon$ Space",
         ),
     ]:
+        config = {
+            "d": d,
+            "series": [
+                {
+                    k: v
+                    for k, v in c.items()
+                    if k in ["e", key, "label", "linestyle", "color"]
+                }
+                for c in computed
+            ],
+            "title": title,
+            "xlabel": r"$\epsilon$",
+            "ylabel": y_label,
+        }
+        fingerprint = figure_fingerprint(inputs, config)
+        if fingerprints.get(key) == fingerprint and os.path.exists(
+            f"{ROOT_DIR}/output/{key}.png"
+        ):
+            print("Unchanged plots", key, flush=True)
+            continue
         print("Creating plots", key, y_label, title, flush=True)
         plot_multiple_series(
             [computed[i]["e"] for i in range(len(computed))],
@@ -219,3 +255,5 @@ if __name__ == "__main__":
             key,
             # line_width=[linewidths[computed[i]["m"]-1] for i in range(len(computed))]
         )
+        fingerprints[key] = fingerprint
+        utils.write_json(fingerprints_path, fingerprints)
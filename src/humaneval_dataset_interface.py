@@ -1,9 +1,9 @@
 import os
 import sys
+import functools
 import numpy as np
-from typing import Optional, Dict, Union, Callable
+from typing import Optional, Dict, Union, Callable, List, Any
 
-PATH_TO_DATA = "/home/akhakhar/data/human_eval/HumanEval.jsonl"
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(ROOT_DIR)
@@ -11,8 +11,30 @@ sys.path.append(BASE_DIR)
 
 from ast_helper import get_num_nodes_from_code
 from utils import utils
+import config
 
-data = utils.read_jsonl(PATH_TO_DATA)
+PATH_TO_DATA = config.get("HUMANEVAL_PATH")
+
+
+@functools.lru_cache(maxsize=None)
+def load_data(path: str = PATH_TO_DATA) -> List[Dict[str, Any]]:
+    """
+    Reads the samples of the human evaluation dataset, once per path.
+
+    Args:
+        path (str, optional): The path of the dataset. Defaults to PATH_TO_DATA.
+
+    Returns:
+        list: The samples of the dataset.
+    """
+    return utils.read_jsonl(path)
+
+
+def __getattr__(name: str) -> Any:
+    # the dataset is read on first access of the data attribute, not on import
+    if name == "data":
+        return load_data()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def prepare_inference_prompt_solution(
@@ -60,6 +82,7 @@ def prepare_inference_prompt_solution(
 
 
 if __name__ == "__main__":
+    data = load_data()
     cnt = 0
     for i in range(len(data)):
         res = prepare_inference_prompt_solution(
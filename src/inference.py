@@ -1,24 +1,95 @@
 import os
 import sys
-from typing import Dict, Optional, Union
+from typing import (
+    Dict,
+    Optional,
+    Union,
+    List,
+    Callable,
+    Awaitable,
+    Any,
+    Tuple,
+    Iterable,
+)
 import time
+import asyncio
+import random
+import argparse
+import traceback
 
 BASE_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.dirname(BASE_DIR)
-LOG_PATH = "/home/akhakhar/shared/code-davinci/"
 sys.path.append(BASE_DIR)
 sys.path.append(ROOT_DIR)
 
 from utils import utils
+import config
 import APPS_dataset_inference
 import humaneval_dataset_interface
-import codex_interface
+from completion_backend import (
+    CompletionBackend,
+    OpenAIBackend,
+    ReplayBackend,
+    NGramBackend,
+    estimate_num_tokens,
+    iter_packed_batches,
+)
+from rate_limit import RateLimiter
+from completion_cache import CompletionCache
+import prompt_manifest
 
+LOG_PATH = config.get("OUTPUT_PATH") + "/"
 SLEEP_PER_REQ = 60
+DEFAULT_BACKEND = OpenAIBackend()
+
+
+def prepare_humaneval_prompt(i: int) -> Optional[Dict[str, Union[str, int]]]:
+    """
+    Prepares the inference prompt of a sample of the human evaluation dataset.
+
+    Args:
+        i (int): The index of the sample in the human evaluation dataset.
+
+    Returns:
+        dict: The prepared prompt and solution, or None if the sample is skipped.
+    """
+    sample = humaneval_dataset_interface.data[i]
+    return humaneval_dataset_interface.prepare_inference_prompt_solution(
+        sample["prompt"],
+        sample["canonical_solution"],
+    )
+
+
+def log_inference(
+    i: int, logging_dir: str, prompt_dict: Dict[str, Union[str, int]], response: Any
+) -> Dict[str, Union[Dict, str]]:
+    """
+    Logs the prompt and response of a sample to its own JSON file in the logging directory.
+
+    Args:
+        i (int): The index of the sample.
+        logging_dir (str): The directory to log the results in.
+        prompt_dict (dict): The prepared prompt of the sample.
+        response (OpenAIObject): The generated completion.
+
+    Returns:
+        dict: A dictionary containing the prompt, response, and name of the log file.
+    """
+    data = {
+        "prompt": prompt_dict,
+        "response": dict(response),
+        "name": logging_dir + str(i),
+    }
+    utils.write_json(data["name"], data)
+    return data
 
 
 def execute_inference_humaneval(
-    i: int, logging_dir: str, max_tokens: int = 30
+    i: int,
+    logging_dir: str,
+    max_tokens: int = 30,
+    get_evaluation: Callable[..., Any] = None,
+    prepare_prompt: Callable[[int], Optional[Dict[str, Union[str, int]]]] = None,
 ) -> Optional[Dict[str, Union[Dict, str]]]:
     """
     Executes inference on a human evaluation dataset and logs the results.
@@ -30,47 +101,504 @@ def execute_inference_humaneval(
         i (int): The index of the sample in the human evaluation dataset.
         logging_dir (str): The directory to log the results in.
         max_tokens (int, optional): The maximum number of tokens in the generated completion. Defaults to 30.
+        get_evaluation (Callable, optional): The function generating a completion, such as a cached one. Defaults to
+            the get_evaluation of DEFAULT_BACKEND.
+        prepare_prompt (Callable, optional): Returns the prepared prompt of an index, such as the lookup of a prompt
+            manifest. Defaults to prepare_humaneval_prompt.
 
     Returns:
         dict: A dictionary containing the prompt, response, and name of the log file, or None if the prepared prompt is None.
     """
-    sample = humaneval_dataset_interface.data[i]
-    prompt_dict = humaneval_dataset_interface.prepare_inference_prompt_solution(
-        sample["prompt"],
-        sample["canonical_solution"],
+    if get_evaluation is None:
+        get_evaluation = DEFAULT_BACKEND.get_evaluation
+    if prepare_prompt is None:
+        prepare_prompt = prepare_humaneval_prompt
+    prompt_dict = prepare_prompt(i)
+    if prompt_dict is None:
+        return None
+    response = get_evaluation(prompt_dict["prompt"], max_tokens=max_tokens)
+    return log_inference(i, logging_dir, prompt_dict, response)
+
+
+def request_key(prompt: str, max_tokens: int) -> str:
+    """
+    Computes the cache key of the request of a prompt, with the defaults of CompletionBackend.get_evaluation.
+
+    Args:
+        prompt (str): The prompt of the request.
+        max_tokens (int): The maximum number of tokens in the generated completion.
+
+    Returns:
+        str: The cache key of the request.
+    """
+    return CompletionCache.request_key(
+        prompt=prompt, logprobs=1, max_tokens=max_tokens, model="code-davinci-002"
     )
+
+
+def execute_inference_humaneval_batch(
+    inds: List[int],
+    logging_dir: str,
+    max_tokens: int = 30,
+    get_evaluation_batch: Callable[..., List[Any]] = None,
+    cache: Optional[CompletionCache] = None,
+    prepare_prompt: Callable[[int], Optional[Dict[str, Union[str, int]]]] = None,
+) -> List[Optional[Dict[str, Union[Dict, str]]]]:
+    """
+    Executes inference on several samples of the human evaluation dataset with a single request and logs the results.
+
+    Args:
+        inds (List[int]): The indices of the samples in the human evaluation dataset.
+        logging_dir (str): The directory to log the results in.
+        max_tokens (int, optional): The maximum number of tokens in the generated completion. Defaults to 30.
+        get_evaluation_batch (Callable, optional): The function generating the completions of a list of prompts.
+            Defaults to the get_evaluation_batch of DEFAULT_BACKEND.
+        cache (CompletionCache, optional): The cache of completions. Defaults to None.
+        prepare_prompt (Callable, optional): Returns the prepared prompt of an index, such as the lookup of a prompt
+            manifest. Defaults to prepare_humaneval_prompt.
+
+    Returns:
+        list: The result of each sample, as returned by execute_inference_humaneval.
+    """
+    if get_evaluation_batch is None:
+        get_evaluation_batch = DEFAULT_BACKEND.get_evaluation_batch
+    if prepare_prompt is None:
+        prepare_prompt = prepare_humaneval_prompt
+    prompt_dicts = [prepare_prompt(i) for i in inds]
+    responses = [None] * len(inds)
+    if cache is not None:
+        for j in range(len(inds)):
+            if prompt_dicts[j] is not None:
+                responses[j] = cache.lookup(
+                    request_key(prompt_dicts[j]["prompt"], max_tokens)
+                )
+    missing = [
+        j
+        for j in range(len(inds))
+        if prompt_dicts[j] is not None and responses[j] is None
+    ]
+    if len(missing) > 0:
+        batch = get_evaluation_batch(
+            [prompt_dicts[j]["prompt"] for j in missing], max_tokens=max_tokens
+        )
+        for j, response in zip(missing, batch):
+            responses[j] = response
+            if cache is not None:
+                cache.put(request_key(prompt_dicts[j]["prompt"], max_tokens), response)
+    return [
+        (
+            None
+            if prompt_dicts[j] is None
+            else log_inference(inds[j], logging_dir, prompt_dicts[j], responses[j])
+        )
+        for j in range(len(inds))
+    ]
+
+
+async def execute_inference_batch_async(
+    items: List[Tuple[int, Dict[str, Union[str, int]]]],
+    logging_dir: str,
+    limiter: RateLimiter,
+    max_tokens: int = 30,
+    max_retries: int = 8,
+    get_evaluation_batch: Callable[..., Awaitable[List[Any]]] = None,
+    cache: Optional[CompletionCache] = None,
+    backend: Optional[CompletionBackend] = None,
+) -> List[Dict[str, Union[Dict, str]]]:
+    """
+    Executes inference on a batch of prepared prompts with a single request within the rate limits and logs the results.
+
+    Requests rejected for exceeding the rate limit are retried with exponential backoff and jitter. Prompts served
+    from the cache are not sent and do not count against the rate limits.
+
+    Args:
+        items (List[tuple]): The index and prepared prompt of each sample.
+        logging_dir (str): The directory to log the results in.
+        limiter (RateLimiter): The rate limiter shared by all requests.
+        max_tokens (int, optional): The maximum number of tokens in the generated completion. Defaults to 30.
+        max_retries (int, optional): The number of retries after a rate limit error. Defaults to 8.
+        get_evaluation_batch (Callable, optional): The coroutine generating the completions of a list of prompts, such
+            as a client of a local stand-in server. Defaults to the get_evaluation_batch_async of the backend.
+        cache (CompletionCache, optional): The cache of completions. Defaults to None.
+        backend (CompletionBackend, optional): The backend of the completions, and of the rate limit errors to
+            retry. Defaults to DEFAULT_BACKEND.
+
+    Returns:
+        list: A dictionary containing the prompt, response, and name of the log file of each sample.
+    """
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if get_evaluation_batch is None:
+        get_evaluation_batch = backend.get_evaluation_batch_async
+    responses = [None] * len(items)
+    if cache is not None:
+        for j, (_, prompt_dict) in enumerate(items):
+            responses[j] = cache.lookup(request_key(prompt_dict["prompt"], max_tokens))
+    missing = [j for j in range(len(items)) if responses[j] is None]
+    if len(missing) > 0:
+        prompts = [items[j][1]["prompt"] for j in missing]
+        num_tokens = sum([estimate_num_tokens(p, max_tokens) for p in prompts])
+        for retry in range(max_retries + 1):
+            await limiter.acquire(num_tokens)
+            try:
+                batch = await get_evaluation_batch(prompts, max_tokens=max_tokens)
+                break
+            except backend.rate_limit_errors:
+                if retry == max_retries:
+                    raise
+                await asyncio.sleep(2**retry + random.random())
+        for j, response in zip(missing, batch):
+            responses[j] = response
+            if cache is not None:
+                cache.put(request_key(items[j][1]["prompt"], max_tokens), response)
+    return [
+        log_inference(i, logging_dir, prompt_dict, response)
+        for (i, prompt_dict), response in zip(items, responses)
+    ]
+
+
+async def execute_inference_humaneval_async(
+    i: int,
+    logging_dir: str,
+    limiter: RateLimiter,
+    max_tokens: int = 30,
+    max_retries: int = 8,
+    get_evaluation: Callable[..., Awaitable[Any]] = None,
+    cache: Optional[CompletionCache] = None,
+    backend: Optional[CompletionBackend] = None,
+    prepare_prompt: Callable[[int], Optional[Dict[str, Union[str, int]]]] = None,
+) -> Optional[Dict[str, Union[Dict, str]]]:
+    """
+    Executes inference on a sample of the human evaluation dataset within the rate limits and logs the results.
+
+    Requests rejected for exceeding the rate limit are retried with exponential backoff and jitter. Requests served
+    from the cache do not count against the rate limits.
+
+    Args:
+        i (int): The index of the sample in the human evaluation dataset.
+        logging_dir (str): The directory to log the results in.
+        limiter (RateLimiter): The rate limiter shared by all requests.
+        max_tokens (int, optional): The maximum number of tokens in the generated completion. Defaults to 30.
+        max_retries (int, optional): The number of retries after a rate limit error. Defaults to 8.
+        get_evaluation (Callable, optional): The coroutine generating a completion, such as a client of a local
+            stand-in server. Defaults to the get_evaluation_async of the backend.
+        cache (CompletionCache, optional): The cache of completions. Defaults to None.
+        backend (CompletionBackend, optional): The backend of the completions. Defaults to DEFAULT_BACKEND.
+        prepare_prompt (Callable, optional): Returns the prepared prompt of an index, such as the lookup of a prompt
+            manifest. Defaults to prepare_humaneval_prompt.
+
+    Returns:
+        dict: A dictionary containing the prompt, response, and name of the log file, or None if the prepared prompt is None.
+    """
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if get_evaluation is None:
+        get_evaluation = backend.get_evaluation_async
+    if prepare_prompt is None:
+        prepare_prompt = prepare_humaneval_prompt
+    prompt_dict = prepare_prompt(i)
     if prompt_dict is None:
         return None
-    response = codex_interface.get_evaluation(
-        prompt_dict["prompt"], max_tokens=max_tokens
+
+    async def get_evaluation_batch(prompts, max_tokens):
+        return [await get_evaluation(prompts[0], max_tokens=max_tokens)]
+
+    return (
+        await execute_inference_batch_async(
+            [(i, prompt_dict)],
+            logging_dir,
+            limiter,
+            max_tokens,
+            max_retries,
+            get_evaluation_batch,
+            cache,
+            backend,
+        )
+    )[0]
+
+
+async def run_inference_humaneval(
+    inds: Iterable[int],
+    logging_dir: str,
+    concurrency: int,
+    requests_per_minute: Optional[float],
+    tokens_per_minute: Optional[float] = None,
+    max_tokens: int = 30,
+    get_evaluation: Callable[..., Awaitable[Any]] = None,
+    cache: Optional[CompletionCache] = None,
+    callback: Optional[Callable[[int, Optional[Dict]], None]] = None,
+    batch_size: int = 1,
+    token_budget: Optional[int] = None,
+    get_evaluation_batch: Callable[..., Awaitable[List[Any]]] = None,
+    backend: Optional[CompletionBackend] = None,
+    prepare_prompt: Callable[[int], Optional[Dict[str, Union[str, int]]]] = None,
+) -> List[Optional[Dict[str, Union[Dict, str]]]]:
+    """
+    Executes inference on many samples of the human evaluation dataset concurrently.
+
+    Requests are sent as the indices arrive, which may be while they are still being written. With a batch size above
+    1, the prompts are packed by iter_packed_batches and each batch is sent as a single request. A sample whose
+    request fails is logged and has the result None, without stopping the others.
+
+    Args:
+        inds (Iterable[int]): The indices of the samples, such as those of a manifest as it is followed.
+        logging_dir (str): The directory to log the results in.
+        concurrency (int): The maximum number of requests in flight.
+        requests_per_minute (float): The maximum number of requests per minute, or None for no limit.
+        tokens_per_minute (float, optional): The maximum number of prompt and completion tokens per minute. Defaults to None.
+        max_tokens (int, optional): The maximum number of tokens in the generated completion. Defaults to 30.
+        get_evaluation (Callable, optional): The coroutine generating a completion. Defaults to the backend's.
+        cache (CompletionCache, optional): The cache of completions. Defaults to None.
+        callback (Callable, optional): Called with the index and result of each sample as it completes. Defaults to None.
+        batch_size (int, optional): The maximum number of prompts of a request. Defaults to 1.
+        token_budget (int, optional): The maximum number of estimated tokens of a request. Defaults to None.
+        get_evaluation_batch (Callable, optional): The coroutine generating the completions of a list of prompts.
+            Defaults to the backend's.
+        backend (CompletionBackend, optional): The backend of the completions. Defaults to DEFAULT_BACKEND.
+        prepare_prompt (Callable, optional): Returns the prepared prompt of an index, such as the lookup of a prompt
+            manifest. Defaults to prepare_humaneval_prompt.
+
+    Returns:
+        list: The result of execute_inference_humaneval_async for each index, or None if it failed, in order.
+    """
+    if prepare_prompt is None:
+        prepare_prompt = prepare_humaneval_prompt
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(i):
+        async with semaphore:
+            try:
+                data = await execute_inference_humaneval_async(
+                    i,
+                    logging_dir,
+                    limiter,
+                    max_tokens,
+                    get_evaluation=get_evaluation,
+                    cache=cache,
+                    backend=backend,
+                    prepare_prompt=prepare_prompt,
+                )
+            except Exception:
+                print(f"[{i}] failed", flush=True)
+                traceback.print_exc()
+                data = None
+        if callback is not None:
+            callback(i, data)
+        return data
+
+    loop = asyncio.get_running_loop()
+    order = []
+
+    async def pull(source):
+        # in a thread, as the next item may not be written yet, such as when following a manifest
+        return await loop.run_in_executor(None, next, source, None)
+
+    if batch_size <= 1:
+        tasks = []
+        source = iter(inds)
+        while True:
+            i = await pull(source)
+            if i is None:
+                break
+            tasks.append(asyncio.ensure_future(run(i)))
+        return await asyncio.gather(*tasks)
+
+    results = {}
+    prompt_dicts = {}
+    skipped = []
+
+    def iter_prompts():
+        for i in inds:
+            order.append(i)
+            prompt_dict = prepare_prompt(i)
+            if prompt_dict is None:
+                skipped.append(i)
+            else:
+                prompt_dicts[i] = prompt_dict
+                yield i, prompt_dict["prompt"]
+
+    async def run_batch(batch):
+        async with semaphore:
+            try:
+                batch_data = await execute_inference_batch_async(
+                    batch,
+                    logging_dir,
+                    limiter,
+                    max_tokens,
+                    get_evaluation_batch=get_evaluation_batch,
+                    cache=cache,
+                    backend=backend,
+                )
+            except Exception:
+                # the samples of a failed request are lost together
+                print(f"{[i for i, _ in batch]} failed", flush=True)
+                traceback.print_exc()
+                batch_data = [None] * len(batch)
+        for (i, _), data in zip(batch, batch_data):
+            results[i] = data
+            if callback is not None:
+                callback(i, data)
+
+    batches = iter_packed_batches(iter_prompts(), batch_size, token_budget, max_tokens)
+    tasks = []
+    while True:
+        batch = await pull(batches)
+        for i in skipped:
+            results[i] = None
+            if callback is not None:
+                callback(i, None)
+        skipped.clear()
+        if batch is None:
+            break
+        batch = [(i, prompt_dicts.pop(i)) for i, _ in batch]
+        tasks.append(asyncio.ensure_future(run_batch(batch)))
+    await asyncio.gather(*tasks)
+    return [results[i] for i in order]
+
+
+def print_inference(i: int, data: Optional[Dict[str, Union[Dict, str]]]):
+    if data is None:
+        print("data is none, skipping...")
+        return
+    print("i:", i)
+    print("solution:", data["prompt"]["solution"])
+    pred_line = data["response"]["choices"][0]["text"].split("\n")[0].strip()
+    print("prediction:", pred_line)
+    print(
+        "-" * 10 + "eql:",
+        data["prompt"]["solution"].strip() == "return" + pred_line,
     )
-    data = {
-        "prompt": prompt_dict,
-        "response": dict(response),
-        "name": logging_dir + str(i),
-    }
-    utils.write_json(data["name"], data)
-    return data
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", dest="start", type=int, default=55)
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=4)
+    parser.add_argument("--rpm", dest="rpm", type=float, default=20)
+    parser.add_argument("--tpm", dest="tpm", type=float, default=40000)
+    parser.add_argument("--api-base", dest="api_base", type=str, default=None)
+    parser.add_argument("--sequential", action="store_true")
+    parser.add_argument("--cache", dest="cache", type=str, default=None)
+    parser.add_argument("--cache-max-mb", dest="cache_max_mb", type=float, default=None)
+    parser.add_argument("--cache-read-only", action="store_true")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1)
+    parser.add_argument("--token-budget", dest="token_budget", type=int, default=None)
+    parser.add_argument(
+        "--backend", choices=["openai", "replay", "ngram"], default="openai"
+    )
+    parser.add_argument("--replay-dirs", dest="replay_dirs", nargs="+", default=[])
+    parser.add_argument("--ngram-order", dest="ngram_order", type=int, default=3)
+    parser.add_argument("--log-path", dest="log_path", type=str, default=LOG_PATH)
+    parser.add_argument("--manifest", dest="manifest", type=str, default=None)
+    args = parser.parse_args()
+    if args.backend == "ngram" and args.cache is not None:
+        # cache keys do not include the backend, so n-gram completions would be served as model completions
+        parser.error("--cache is not supported with the ngram backend")
+    if args.backend == "replay":
+        backend = ReplayBackend([args.log_path + d for d in args.replay_dirs])
+    elif args.backend == "ngram":
+        backend = NGramBackend(
+            [
+                sample["prompt"] + sample["canonical_solution"]
+                for sample in humaneval_dataset_interface.data
+            ],
+            args.ngram_order,
+        )
+    else:
+        backend = DEFAULT_BACKEND
+    if args.api_base is not None:
+        import codex_interface
+
+        codex_interface.openai.api_base = args.api_base
+    get_evaluation = backend.get_evaluation
+    cache = None
+    if args.cache is not None:
+        cache = CompletionCache(
+            args.cache,
+            None if args.cache_max_mb is None else int(args.cache_max_mb * 2**20),
+            args.cache_read_only,
+        )
+        get_evaluation = cache.wrap(get_evaluation)
     str_time_id = str(int(time.time()))
-    logging_dir = LOG_PATH + str_time_id + "/"
+    logging_dir = args.log_path + str_time_id + "/"
     os.makedirs(logging_dir, exist_ok=True)
-    cnt = 0
-    for i in range(55, len(humaneval_dataset_interface.data)):
-        data = execute_inference_humaneval(i, logging_dir)
-        if data is None:
-            print("data is none, skipping...")
-            continue
-        print("i:", i)
-        print("solution:", data["prompt"]["solution"])
-        pred_line = data["response"]["choices"][0]["text"].split("\n")[0].strip()
-        print("prediction:", pred_line)
-        print(
-            "-" * 10 + "eql:",
-            data["prompt"]["solution"].strip() == "return" + pred_line,
+    if args.manifest is not None:
+        # prompts prepared by prompt_manifest.py, without the ineligible samples, read as they are appended
+        manifest = {}
+
+        def follow_manifest_inds():
+            for i, prompt_dict in prompt_manifest.follow_manifest(args.manifest):
+                if i >= args.start:
+                    manifest[i] = prompt_dict
+                    yield i
+
+        prepare_prompt = manifest.get
+        inds = follow_manifest_inds()
+    else:
+        prepare_prompt = prepare_humaneval_prompt
+        inds = list(range(args.start, len(humaneval_dataset_interface.data)))
+    if args.sequential and args.batch_size > 1:
+        cnt = 0
+        for batch in iter_packed_batches(
+            (
+                (i, prepare_prompt(i)["prompt"])
+                for i in inds
+                if prepare_prompt(i) is not None
+            ),
+            args.batch_size,
+            args.token_budget,
+            max_tokens=30,
+        ):
+            misses = None if cache is None else cache.misses
+            batch_inds = [i for i, _ in batch]
+            batch_data = execute_inference_humaneval_batch(
+                batch_inds,
+                logging_dir,
+                get_evaluation_batch=backend.get_evaluation_batch,
+                cache=cache,
+                prepare_prompt=prepare_prompt,
+            )
+            for i, data in zip(batch_inds, batch_data):
+                print_inference(i, data)
+            cnt += len(batch_inds)
+            # only requests that reached a remote model count against the quota
+            if backend.remote and (cache is None or cache.misses != misses):
+                time.sleep(SLEEP_PER_REQ)
+    elif args.sequential:
+        cnt = 0
+        for i in inds:
+            misses = None if cache is None else cache.misses
+            data = execute_inference_humaneval(
+                i,
+                logging_dir,
+                get_evaluation=get_evaluation,
+                prepare_prompt=prepare_prompt,
+            )
+            print_inference(i, data)
+            if data is None:
+                continue
+            cnt += 1
+            # only requests that reached a remote model count against the quota
+            if backend.remote and (cache is None or cache.misses != misses):
+                time.sleep(SLEEP_PER_REQ)
+    else:
+        results = asyncio.run(
+            run_inference_humaneval(
+                inds,
+                logging_dir,
+                args.concurrency,
+                args.rpm if backend.remote else None,
+                args.tpm if backend.remote else None,
+                cache=cache,
+                callback=print_inference,
+                batch_size=args.batch_size,
+                token_budget=args.token_budget,
+                backend=backend,
+                prepare_prompt=prepare_prompt,
+            )
         )
-        cnt += 1
-        time.sleep(SLEEP_PER_REQ)
+        cnt = len([data for data in results if data is not None])
     print(logging_dir, cnt)
+    if cache is not None:
+        print("cache", cache.stats())
@@ -11,6 +11,9 @@ ROOT_DIR = os.path.dirname(BASE_DIR)
 import parse_results
 import ast_helper
 
+# the between tau level constraints nest the pruned trees of decreasing thresholds
+NESTED_THRESHOLDS = True
+
 
 def add_tree_constraints(
     o: z3.z3.Optimize, tree: ast_helper.Node, cost_id: str = "", m: int = -1
@@ -0,0 +1,580 @@
+from collections import deque
+import os
+import sys
+import numpy as np
+from typing import Any, List, Tuple, Dict, Union, Optional, Set
+
+BASE_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+
+import ast_helper
+import compact_tree
+from pruned_sequence import PrunedTreeSequence
+
+# every threshold is solved within the nodes kept by the previous, larger one, so the pruned trees are nested
+NESTED_THRESHOLDS = True
+
+MAX_NODE_COST = 10
+
+
+def node_cost(nll: Optional[float]) -> Optional[float]:
+    """
+    Computes the cost of keeping a node with the given negative log likelihood, mirroring the z3 formulation in optimize.py.
+
+    Args:
+        nll (float): The negative log likelihood of the node.
+
+    Returns:
+        float: The negative log likelihood clipped to [0, MAX_NODE_COST], or None if the node has no probability.
+    """
+    if nll is None or nll == -1 or np.isnan(nll):
+        return None
+    return float(min(MAX_NODE_COST, max(nll, 0)))
+
+
+def reduce_tree(
+    tree: ast_helper.Node,
+) -> Tuple[
+    List[ast_helper.Node], List[Optional[float]], Dict[int, List[int]], List[int]
+]:
+    """
+    Flattens the given tree in breadth first order and links every node with a probability to its closest descendants with a probability.
+
+    Nodes without a probability are never removed by the optimization, so they are skipped when linking parents to children.
+
+    Args:
+        tree (Node): The root node of the tree.
+
+    Returns:
+        tuple: A tuple containing the nodes in breadth first order, the cost of each node, a map of node index to the indices of its reduced children, and the indices of the reduced roots.
+    """
+    nodes = []
+    costs = []
+    reduced_children = {}
+    reduced_roots = []
+    q = deque()
+    # (node, index of closest ancestor with a probability)
+    q.append((tree, None))
+    while len(q) > 0:
+        curr_node, ancestor_ind = q.popleft()
+        curr_ind = len(nodes)
+        nodes.append(curr_node)
+        costs.append(node_cost(curr_node.nll))
+        if costs[curr_ind] is not None:
+            reduced_children[curr_ind] = []
+            if ancestor_ind is None:
+                reduced_roots.append(curr_ind)
+            else:
+                reduced_children[ancestor_ind].append(curr_ind)
+            ancestor_ind = curr_ind
+        for c in curr_node.children:
+            q.append((c, ancestor_ind))
+    return nodes, costs, reduced_children, reduced_roots
+
+
+def min_plus_merge(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Merges two (holes, nodes kept) -> minimum cost tables, adding holes and nodes kept of every pair of entries.
+
+    Args:
+        a (np.ndarray): The first table of shape (H, Ka).
+        b (np.ndarray): The second table of shape (H, Kb).
+
+    Returns:
+        np.ndarray: The merged table of shape (H, Ka + Kb - 1).
+    """
+    num_holes = a.shape[0]
+    merged = np.full((num_holes, a.shape[1] + b.shape[1] - 1), np.inf)
+    for h_a in range(num_holes):
+        for k_a in np.flatnonzero(np.isfinite(a[h_a])):
+            for h_b in range(num_holes - h_a):
+                np.minimum(
+                    merged[h_a + h_b, k_a : k_a + b.shape[1]],
+                    a[h_a, k_a] + b[h_b],
+                    out=merged[h_a + h_b, k_a : k_a + b.shape[1]],
+                )
+    return merged
+
+
+def reduce_compact_tree(
+    tree: compact_tree.CompactTree,
+) -> Tuple[None, List[Optional[float]], Dict[int, List[int]], List[int]]:
+    """
+    Links every node of the given compact tree with a probability to its closest descendants with a probability, like reduce_tree.
+
+    Args:
+        tree (CompactTree): The compact tree, whose nodes are already in breadth first order.
+
+    Returns:
+        tuple: A tuple containing None in place of the nodes, the cost of each node, a map of node index to the indices of its reduced children, and the indices of the reduced roots.
+    """
+    costs = [node_cost(nll) for nll in tree.nll.tolist()]
+    reduced_children = {}
+    reduced_roots = []
+    # index of closest ancestor with a probability, including the node itself
+    ancestor = [None] * len(tree)
+    for curr_ind, parent_ind in enumerate(tree.parent.tolist()):
+        ancestor_ind = ancestor[parent_ind] if parent_ind >= 0 else None
+        if costs[curr_ind] is not None:
+            reduced_children[curr_ind] = []
+            if ancestor_ind is None:
+                reduced_roots.append(curr_ind)
+            else:
+                reduced_children[ancestor_ind].append(curr_ind)
+            ancestor_ind = curr_ind
+        ancestor[curr_ind] = ancestor_ind
+    return None, costs, reduced_children, reduced_roots
+
+
+class TreeKnapsack:
+    """
+    Exact dynamic programming solver for the tree pruning problem of optimize.solve_optimization_lst.
+
+    For every node with a probability, the solver computes the minimum cost of keeping that node together with a
+    connected set of its descendants, indexed by the number of holes and the number of nodes kept. A kept node whose
+    reduced child is removed creates one hole.
+
+    Attributes:
+        tree (Union[Node, CompactTree]): The tree to prune.
+        m (int): The maximum number of holes in the tree, or -1 for no limit.
+        nodes (list): The nodes of the tree in breadth first order, or None for a compact tree.
+        costs (list): The cost of each node, or None for nodes without a probability.
+        reduced_children (dict): A map of node index to the indices of its reduced children.
+        reduced_roots (list): The indices of the nodes with a probability and no ancestor with a probability.
+    """
+
+    def __init__(
+        self, tree: Union[ast_helper.Node, compact_tree.CompactTree], m: int = -1
+    ):
+        self.tree = tree
+        self.m = m
+        self.num_holes = m + 1 if m != -1 else 1
+        self.hole = 1 if m != -1 else 0
+        (
+            self.nodes,
+            self.costs,
+            self.reduced_children,
+            self.reduced_roots,
+        ) = (
+            reduce_compact_tree(tree)
+            if isinstance(tree, compact_tree.CompactTree)
+            else reduce_tree(tree)
+        )
+
+    def removed_option(self, holes: int) -> np.ndarray:
+        """
+        Creates the table of removing a node, which keeps no nodes and adds the given number of holes.
+
+        Args:
+            holes (int): The number of holes created by removing the node.
+
+        Returns:
+            np.ndarray: A table of shape (H, 1).
+        """
+        option = np.full((self.num_holes, 1), np.inf)
+        if holes < self.num_holes:
+            option[holes, 0] = 0.0
+        return option
+
+    def solve(self, allowed: Optional[Set[int]] = None) -> None:
+        """
+        Fills the dynamic programming tables of the tree.
+
+        Args:
+            allowed (Set[int], optional): The indices of the nodes with a probability that may be kept, or None for
+                every node. Defaults to None.
+        """
+        self.tables = {}
+        self.prefix_tables = {}
+        self.options = {}
+        # children appear after their parents in breadth first order
+        for ind in sorted(self.reduced_children, reverse=True):
+            if allowed is not None and ind not in allowed:
+                # a node that may not be kept only has the option of being removed
+                self.tables[ind] = np.full((self.num_holes, 1), np.inf)
+                self.prefix_tables[ind] = [self.tables[ind]]
+                continue
+            table = np.full((self.num_holes, 2), np.inf)
+            table[0, 1] = self.costs[ind]
+            prefix = [table]
+            for c in self.reduced_children[ind]:
+                self.options[c] = self.child_option(c, self.hole)
+                table = min_plus_merge(table, self.options[c])
+                prefix.append(table)
+            self.tables[ind] = table
+            self.prefix_tables[ind] = prefix
+        # reduced roots have no kept parent, so removing them creates no hole
+        table = np.full((self.num_holes, 1), np.inf)
+        table[0, 0] = 0.0
+        prefix = [table]
+        for r in self.reduced_roots:
+            self.options[r] = self.child_option(r, 0)
+            table = min_plus_merge(table, self.options[r])
+            prefix.append(table)
+        self.root_table = table
+        self.root_prefix_tables = prefix
+
+    def child_option(self, ind: int, holes: int) -> np.ndarray:
+        """
+        Creates the table of either removing or keeping the given node.
+
+        Args:
+            ind (int): The index of the node.
+            holes (int): The number of holes created by removing the node.
+
+        Returns:
+            np.ndarray: The minimum cost table of the node's options.
+        """
+        return np.concatenate(
+            [self.removed_option(holes), self.tables[ind][:, 1:]], axis=1
+        )
+
+    def best_solution(self, max_cost: float) -> Tuple[int, int, float]:
+        """
+        Finds the largest number of nodes that can be kept within the given cost.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            tuple: A tuple containing the number of holes, the number of nodes kept and the cost of the solution.
+        """
+        cost_per_kept = self.root_table.min(axis=0)
+        feasible = np.flatnonzero(cost_per_kept <= max_cost)
+        # removing every node is always feasible for a non negative threshold
+        k = int(feasible[-1]) if len(feasible) > 0 else 0
+        h = int(np.argmin(self.root_table[:, k]))
+        return h, k, float(self.root_table[h, k])
+
+    def breakpoints(self) -> List[Tuple[int, int, float]]:
+        """
+        Finds the solutions that are cheaper than every solution keeping more nodes.
+
+        Returns:
+            list: The number of holes, the number of nodes kept and the cost of each solution, in descending order.
+        """
+        cost_per_kept = self.root_table.min(axis=0)
+        breakpoints = []
+        min_cost = np.inf
+        for k in range(len(cost_per_kept) - 1, -1, -1):
+            if cost_per_kept[k] < min_cost:
+                h = int(np.argmin(self.root_table[:, k]))
+                breakpoints.append((h, k, float(cost_per_kept[k])))
+                min_cost = cost_per_kept[k]
+        return breakpoints
+
+    def backtrack(
+        self,
+        prefix: List[np.ndarray],
+        children: List[int],
+        h: int,
+        k: int,
+        kept: Set[int],
+    ) -> None:
+        """
+        Recovers the nodes kept by an entry of a table from the tables it was merged from.
+
+        Args:
+            prefix (List[np.ndarray]): The tables after merging each child.
+            children (List[int]): The indices of the children merged into the tables.
+            h (int): The number of holes of the entry.
+            k (int): The number of nodes kept of the entry.
+            kept (Set[int]): The set to add the indices of the kept nodes to.
+        """
+        for i in range(len(children) - 1, -1, -1):
+            option = self.options[children[i]]
+            before = prefix[i]
+            best = None
+            for h_c in range(h + 1):
+                for k_c in range(min(k, option.shape[1] - 1) + 1):
+                    if k - k_c >= before.shape[1]:
+                        continue
+                    cost = before[h - h_c, k - k_c] + option[h_c, k_c]
+                    if best is None or cost < best[0]:
+                        best = (cost, h_c, k_c)
+            _, h_c, k_c = best
+            if k_c > 0:
+                kept.add(children[i])
+                c = children[i]
+                self.backtrack(
+                    self.prefix_tables[c], self.reduced_children[c], h_c, k_c, kept
+                )
+            h -= h_c
+            k -= k_c
+
+    def kept_nodes(self, h: int, k: int) -> Set[int]:
+        """
+        Recovers the nodes kept by the solution with the given number of holes and nodes kept.
+
+        Args:
+            h (int): The number of holes of the solution.
+            k (int): The number of nodes kept of the solution.
+
+        Returns:
+            set: The indices of the kept nodes with a probability.
+        """
+        kept = set()
+        self.backtrack(self.root_prefix_tables, self.reduced_roots, h, k, kept)
+        return kept
+
+
+def create_tree(
+    solver: TreeKnapsack, kept: Set[int]
+) -> Dict[str, Union[ast_helper.Node, str, Dict[str, bool], List[List[str]], float]]:
+    """
+    Creates a pruned tree from the given tree based on the nodes kept by the solver.
+
+    Args:
+        solver (TreeKnapsack): The solver of the tree.
+        kept (Set[int]): The indices of the kept nodes with a probability.
+
+    Returns:
+        dict: A dictionary containing the pruned root, the entire tree with deleted nodes, a map of node names to inclusion, a check status, a list of tuples, the total error of the tree, and the fraction of nodes included.
+    """
+    map_node_name_to_include = {}
+    tuples = []
+    included_nodes = 0
+    error_of_tree = 0
+    pruned_root = ast_helper.Node("root_pruned")
+    entire_tree_with_deleted = ast_helper.Node("root_entire")
+    pruned_nodes = []
+    entire_nodes = []
+    # nodes are in breadth first order, so parents are created before their children
+    parent_ind = {}
+    for ind, node in enumerate(solver.nodes):
+        for c in node.children:
+            parent_ind[id(c)] = ind
+    for ind, node in enumerate(solver.nodes):
+        name_of_curr = node.code + "::" + str(ind)
+        deleted = solver.costs[ind] is not None and ind not in kept
+        if solver.costs[ind] is not None:
+            map_node_name_to_include[name_of_curr] = not deleted
+            tuples.append([name_of_curr, str(not deleted)])
+        pruned_node = ast_helper.Node(node.code)
+        entire_node = ast_helper.Node(node.code)
+        for n in [pruned_node, entire_node]:
+            n.nll = node.nll
+            n.intervals = node.intervals
+            n.colon_name = name_of_curr
+            n.deleted = deleted
+        pruned_parent = pruned_root if ind == 0 else pruned_nodes[parent_ind[id(node)]]
+        entire_parent = (
+            entire_tree_with_deleted if ind == 0 else entire_nodes[parent_ind[id(node)]]
+        )
+        entire_parent.children.append(entire_node)
+        if not deleted:
+            pruned_parent.children.append(pruned_node)
+            included_nodes += 1
+            error_of_tree += node.nll if solver.costs[ind] is not None else 0
+        pruned_nodes.append(pruned_node)
+        entire_nodes.append(entire_node)
+    return {
+        "pruned_root": (
+            pruned_root.children[0] if len(pruned_root.children) > 0 else None
+        ),
+        "entire_tree_with_deleted": (
+            entire_tree_with_deleted.children[0]
+            if len(entire_tree_with_deleted.children) > 0
+            else None
+        ),
+        "map": map_node_name_to_include,
+        "check": "sat",
+        "tuples": tuples,
+        "error_of_tree": error_of_tree,
+        "frac_included": included_nodes / len(solver.nodes),
+    }
+
+
+class Frontier:
+    """
+    The cost / nodes kept frontier of a tree for a hole budget.
+
+    Entry i is kept for every threshold max_cost in [costs[i], costs[i - 1]). Without thresholds, entry i keeps the
+    largest number of nodes with a cost of at most max_cost, exactly, and the kept nodes of each entry are recovered on
+    first use. With thresholds, the entry of the largest threshold is exact, and the entry of every other threshold
+    keeps the largest number of the nodes kept by the entry of the previous, larger threshold within its cost, so the
+    kept nodes of the entries are nested like the pruned trees of optimize.py. The knapsack is only solved again
+    within the kept nodes of the previous entry when the exact solution of a threshold is not nested.
+
+    Attributes:
+        solver (TreeKnapsack): The knapsack of the tree.
+        costs (np.ndarray): The minimum cost of each entry, in descending order.
+        num_kept (np.ndarray): The number of nodes with a probability kept by each entry, in descending order.
+        num_holes (np.ndarray): The number of holes of each entry.
+        kept (dict): The indices of the kept nodes with a probability of each recovered entry.
+    """
+
+    def __init__(self, solver: TreeKnapsack, max_costs: Optional[List[float]] = None):
+        self.solver = solver
+        self.kept = {}
+        solver.solve()
+        if max_costs is None:
+            entries = solver.breakpoints()
+        else:
+            entries = []
+            for max_cost in sorted(max_costs, reverse=True):
+                # the previous entry is within this threshold, or keeps no node
+                if len(entries) > 0 and (
+                    entries[-1][2] <= max_cost or entries[-1][1] == 0
+                ):
+                    continue
+                h, k, cost = solver.best_solution(max_cost)
+                kept = solver.kept_nodes(h, k)
+                if len(entries) > 0 and not kept <= self.kept[len(entries) - 1]:
+                    solver.solve(self.kept[len(entries) - 1])
+                    h, k, cost = solver.best_solution(max_cost)
+                    kept = solver.kept_nodes(h, k)
+                self.kept[len(entries)] = kept
+                entries.append((h, k, cost))
+        self.num_holes = np.array([h for h, _, _ in entries], dtype=int)
+        self.num_kept = np.array([k for _, k, _ in entries], dtype=int)
+        self.costs = np.array([cost for _, _, cost in entries])
+
+    def __len__(self):
+        return len(self.costs)
+
+    def lookup(self, max_cost: float) -> int:
+        """
+        Finds the frontier entry kept for the given threshold with a binary search over the breakpoints.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            int: The index of the first entry with a cost of at most max_cost.
+        """
+        ind = int(np.searchsorted(-self.costs, -max_cost, side="left"))
+        return min(ind, len(self.costs) - 1)
+
+    def kept_nodes(self, ind: int) -> Set[int]:
+        """
+        Recovers the kept nodes of the given frontier entry.
+
+        Args:
+            ind (int): The index of the frontier entry.
+
+        Returns:
+            set: The indices of the kept nodes with a probability.
+        """
+        if ind not in self.kept:
+            self.kept[ind] = self.solver.kept_nodes(
+                int(self.num_holes[ind]), int(self.num_kept[ind])
+            )
+        return self.kept[ind]
+
+    def pruned_tree(
+        self, max_cost: float
+    ) -> Dict[
+        str, Union[ast_helper.Node, str, Dict[str, bool], List[List[str]], float]
+    ]:
+        """
+        Creates the pruned tree kept for the given threshold.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            dict: A dictionary containing the pruned tree for the threshold, as returned by create_tree.
+        """
+        return create_tree(self.solver, self.kept_nodes(self.lookup(max_cost)))
+
+    def deleted_mask(self, ind: int) -> np.ndarray:
+        """
+        Computes which nodes the given frontier entry deletes, in breadth first order.
+
+        Args:
+            ind (int): The index of the frontier entry.
+
+        Returns:
+            np.ndarray: Whether each node is deleted.
+        """
+        kept = self.kept_nodes(ind)
+        deleted = np.zeros(len(self.solver.costs), dtype=bool)
+        deleted[[i for i in self.solver.reduced_children if i not in kept]] = True
+        return deleted
+
+    def summary(self, max_cost: float) -> Dict[str, Any]:
+        """
+        Summarizes the pruned tree kept for the given threshold like create_tree, without creating it.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            dict: The deleted mask, the error_of_tree, frac_included and check of the pruned tree, and the breadth first
+                indices of the nodes of its map.
+        """
+        deleted = self.deleted_mask(self.lookup(max_cost))
+        nll = (
+            self.solver.tree.nll.tolist()
+            if self.solver.nodes is None
+            else [n.nll for n in self.solver.nodes]
+        )
+        error_of_tree = 0
+        for ind, d in enumerate(deleted.tolist()):
+            if self.solver.costs[ind] is not None and not d:
+                error_of_tree += nll[ind]
+        return {
+            "deleted": deleted,
+            "check": "sat",
+            "error_of_tree": error_of_tree,
+            "frac_included": int(np.sum(~deleted)) / len(deleted),
+            "map_inds": sorted(self.solver.reduced_children),
+        }
+
+    def pruned_compact_tree(self, max_cost: float) -> compact_tree.CompactTree:
+        """
+        Creates a view of the compact tree with the nodes deleted for the given threshold, without copying the tree.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            CompactTree: The compact tree with the deleted mask of the threshold.
+        """
+        return self.solver.tree.with_deleted(self.deleted_mask(self.lookup(max_cost)))
+
+
+def compute_frontier(
+    tree: Union[ast_helper.Node, compact_tree.CompactTree],
+    m: int,
+    max_costs: Optional[List[float]] = None,
+) -> Frontier:
+    """
+    Computes the cost / nodes kept frontier of the given tree.
+
+    Args:
+        tree (Union[Node, CompactTree]): The tree to prune.
+        m (int): The maximum number of holes in the tree.
+        max_costs (List[float], optional): The thresholds to nest the entries for, or None for the exact entry of
+            every threshold. Defaults to None.
+
+    Returns:
+        Frontier: The frontier of the tree.
+    """
+    return Frontier(TreeKnapsack(tree, m), max_costs)
+
+
+def create_tree_from_optimization_result_lst(
+    tree: ast_helper.Node, m: int, max_cost_threshold: List[float]
+) -> PrunedTreeSequence:
+    """
+    Creates a list of pruned trees from the given tree for each maximum cost threshold in the given list.
+
+    The largest threshold keeps the largest number of nodes within its cost, and every other threshold the largest
+    number within its cost among the nodes kept by the previous, larger threshold, so the pruned trees are nested
+    like those of optimize.solve_optimization_lst. The pruned tree of each threshold is created when it is accessed.
+
+    Args:
+        tree (Node): The root node of the tree to prune.
+        m (int): The maximum number of holes in the tree.
+        max_cost_threshold (List[float]): A list of maximum total cost thresholds.
+
+    Returns:
+        PrunedTreeSequence: A sequence of dictionaries, each containing a pruned tree for a maximum cost threshold in the given list.
+    """
+    frontier = compute_frontier(tree, m, max_cost_threshold)
+    return PrunedTreeSequence(
+        frontier.pruned_tree, max_cost_threshold, frontier.summary
+    )
@@ -1,15 +1,19 @@
 from collections import deque
+from collections.abc import Sequence
 import os
 import sys
 import heapq
-from typing import List, Optional, Dict, Union
-import code
-import traceback
+import numpy as np
+from typing import List, Optional, Dict, Union, Any
 
 BASE_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(BASE_DIR)
 import ast_helper
+from pruned_sequence import PrunedTreeSequence
+
+# the removals of a smaller threshold extend the removals of a larger one
+NESTED_THRESHOLDS = True
 
 
 def duplicate_tree(node: ast_helper.Node) -> ast_helper.Node:
@@ -145,6 +149,128 @@ def calculate_error_of_tree_undeleted(node: ast_helper.Node) -> float:
         )
 
 
+class GreedyRemoval:
+    """
+    Incremental state of the greedy removal of nodes from a tree.
+
+    The number of holes and the total error of the undeleted nodes are updated as nodes are removed, instead of
+    walking the whole tree after every removal. Removed nodes left in the heaps are skipped when popped.
+
+    Attributes:
+        root (Node): The root node of the tree to prune.
+        m (int): The maximum number of holes in the tree.
+        total_nodes (int): The number of nodes in the tree.
+        error_of_tree (float): The total error of the undeleted nodes.
+        holes (int): The number of deleted holes in the tree, as computed by calculate_m.
+    """
+
+    def __init__(self, root: ast_helper.Node, m: int):
+        assert m > 0
+        self.root = root
+        self.m = m
+        self.map_node_to_parent = {root: None}
+        self.map_node_to_included_children = {}
+        # breadth first index of each node, used to break ties between nodes of equal cost
+        self.map_node_to_order = {}
+        self.max_heap_cost_leaves = []
+        self.max_heap_cost_leaves_parent_of_rm_nodes = []
+        self.total_nodes = 0
+        self.error_of_tree = 0
+        self.holes = 0
+        q = deque()
+        q.append(root)
+        while len(q) > 0:
+            curr = q.popleft()
+            self.map_node_to_order[curr] = self.total_nodes
+            self.total_nodes += 1
+            self.error_of_tree += curr.nll
+            self.map_node_to_included_children[curr] = len(curr.children)
+            for child in curr.children:
+                self.map_node_to_parent[child] = curr
+                q.append(child)
+            if len(curr.children) == 0:
+                self.push(self.max_heap_cost_leaves, curr)
+
+    def push(self, heap: List, node: ast_helper.Node) -> None:
+        """
+        Pushes a node onto a max heap of node costs.
+
+        Args:
+            heap (list): The heap to push onto.
+            node (Node): The node to push.
+        """
+        heapq.heappush(heap, (-1 * node.nll, self.map_node_to_order[node], node))
+
+    def pop(self, heap: List) -> Optional[ast_helper.Node]:
+        """
+        Pops the largest cost node that is not deleted from a max heap of node costs.
+
+        Args:
+            heap (list): The heap to pop from.
+
+        Returns:
+            Node: The popped node, or None if the heap has no undeleted node.
+        """
+        while len(heap) > 0:
+            _, _, node = heapq.heappop(heap)
+            if not node.deleted:
+                return node
+        return None
+
+    def next_node(self) -> Optional[ast_helper.Node]:
+        """
+        Pops the next node to remove without violating the maximum number of holes.
+
+        Returns:
+            Node: The next node to remove, or None if no node can be removed.
+        """
+        if self.holes >= self.m:
+            # remove largest cost node of parent of nodes already removed
+            return self.pop(self.max_heap_cost_leaves_parent_of_rm_nodes)
+        # rm the largest leaf node
+        return self.pop(self.max_heap_cost_leaves)
+
+    def remove(self, rm_node: ast_helper.Node) -> None:
+        """
+        Marks the given node and its descendants as deleted and updates the holes, error and heaps.
+
+        Args:
+            rm_node (Node): The undeleted node to remove.
+        """
+        # deleted nodes reached from rm_node are holes that merge into the new hole
+        self.holes += 1
+        stack = [rm_node]
+        while len(stack) > 0:
+            curr = stack.pop()
+            if curr.deleted:
+                self.holes -= 1
+                continue
+            curr.deleted = True
+            self.error_of_tree -= curr.nll
+            stack += curr.children
+        parent = self.map_node_to_parent[rm_node]
+        if parent is None:
+            return
+        self.map_node_to_included_children[parent] -= 1
+        # add parent to tree if valid
+        if self.map_node_to_included_children[parent] == 0:
+            self.push(self.max_heap_cost_leaves, parent)
+        # update the max_heap_cost_leaves_parent_of_rm_nodes
+        self.push(self.max_heap_cost_leaves_parent_of_rm_nodes, parent)
+
+    def step(self) -> Optional[ast_helper.Node]:
+        """
+        Removes the next node.
+
+        Returns:
+            Node: The removed node, or None if no node can be removed.
+        """
+        rm_node = self.next_node()
+        if rm_node is not None:
+            self.remove(rm_node)
+        return rm_node
+
+
 def greedy_removal(
     root: ast_helper.Node, max_cost: float, m: int
 ) -> Dict[str, Union[ast_helper.Node, str, float, float]]:
@@ -154,70 +280,15 @@ def greedy_removal(
     Args:
         root (Node): The root node of the subtree to prune.
         max_cost (float): The maximum total cost threshold.
-        m (int): The minimum number of nodes to keep in the subtree.
+        m (int): The maximum number of holes in the subtree.
 
     Returns:
         dict: A dictionary containing the pruned root, the entire tree with deleted nodes, a check status, the total error of the tree, and the fraction of nodes included.
     """
-    assert m > 0
-    print("\nGREEDY_REMOVAL")
-    subtree_cost_map = map_node_to_subtree_cost(root)
-    subtree_cost_map[None] = 0
-    map_node_to_parent = {}
-    map_node_to_included_children = {}
-    max_heap_cost_leaves = []
-    q = deque()
-    q.append(root)
-    total_nodes = 0
-    error_of_tree = 0
-    # creates map_node_to_parents, max_heap_cost_leaves, total_nodes, error_of_tree
-    while len(q) > 0:
-        curr = q.popleft()
-        total_nodes += 1
-        error_of_tree += curr.nll
-        map_node_to_included_children[curr] = len(curr.children)
-        for child in curr.children:
-            map_node_to_parent[child] = curr
-            q.append(child)
-        if len(curr.children) == 0:
-            heapq.heappush(max_heap_cost_leaves, (-1 * curr.nll, curr))
-
-    max_heap_cost_leaves_parent_of_rm_nodes = []
-    print("error_of_tree", error_of_tree)
-    print("max_cost", max_cost)
-    while len(max_heap_cost_leaves) > 0 and error_of_tree > max_cost:
-        # make sure removed node does not violate m
-        curr_tree_m = calculate_m(root)
-        print("---")
-        print("\tcurr_m", curr_tree_m)
-        print("\terror_of_tree", error_of_tree)
-        print(
-            "\tCURR MAX HEAP",
-            [(c, n.get_interval_str(root.code, n)) for c, n in max_heap_cost_leaves],
-        )
-        rm_node = None
-        if curr_tree_m == m:
-            # remove largest cost node of parent of nodes already removed
-            _, rm_node = heapq.heappop(max_heap_cost_leaves_parent_of_rm_nodes)
-        else:
-            # rm the largest leaf node
-            cost, rm_node = heapq.heappop(max_heap_cost_leaves)
-        print("\tRemoved Node", rm_node.get_interval_str(root.code, rm_node))
-        del_node_and_all_children(rm_node)
-        error_of_tree = calculate_error_of_tree_undeleted(root)
-        parent = map_node_to_parent[rm_node]
-        map_node_to_included_children[parent] -= 1
-        # add parent to tree if valid
-        if map_node_to_included_children[parent] == 0:
-            try:
-                heapq.heappush(max_heap_cost_leaves, (-1 * parent.nll, parent))
-            except:
-                traceback.print_exc()
-                code.interact(local=locals())
-        # update the max_heap_cost_leaves_parent_of_rm_nodes
-        heapq.heappush(
-            max_heap_cost_leaves_parent_of_rm_nodes, (-1 * parent.nll, parent)
-        )
+    state = GreedyRemoval(root, m)
+    while state.error_of_tree > max_cost:
+        if state.step() is None:
+            break
 
     error_of_tree = calculate_error_of_tree_undeleted(root)
     return {
@@ -225,26 +296,163 @@ def greedy_removal(
         "entire_tree_with_deleted": root,
         "check": "sat" if error_of_tree <= max_cost else "unsat",
         "error_of_tree": error_of_tree,
-        "frac_included": num_node_not_deleted(root) / total_nodes,
+        "frac_included": num_node_not_deleted(root) / state.total_nodes,
     }
 
 
+def bfs_nodes(root: ast_helper.Node) -> List[ast_helper.Node]:
+    """
+    Lists the nodes of the given node's subtree in breadth first order.
+
+    Args:
+        root (Node): The root node of the subtree.
+
+    Returns:
+        list: The nodes of the subtree in breadth first order.
+    """
+    nodes = [root]
+    for curr in nodes:
+        nodes += curr.children
+    return nodes
+
+
+class GreedyTrace:
+    """
+    The full sequence of greedy removals of a tree, with the error of the tree after each removal.
+
+    The removal order does not depend on the maximum cost threshold, only on when greedy_removal stops, so the pruned
+    tree of every threshold is a prefix of the trace.
+
+    Attributes:
+        tree (Node): The root node of the tree to prune, which is not modified.
+        m (int): The maximum number of holes in the tree.
+        removed (list): The breadth first index of each removed node, in order of removal.
+        errors (list): The total error of the undeleted nodes after each number of removals, starting with none.
+        children (list): The breadth first indices of the children of each node.
+        parent (list): The breadth first index of the parent of each node, or -1 for the root.
+        nll (list): The negative log likelihood of each node.
+    """
+
+    def __init__(self, tree: ast_helper.Node, m: int):
+        self.tree = tree
+        self.m = m
+        copy_tree = duplicate_tree(tree)
+        nodes = bfs_nodes(copy_tree)
+        map_node_to_ind = {n: i for i, n in enumerate(nodes)}
+        self.children = [[map_node_to_ind[c] for c in n.children] for n in nodes]
+        self.parent = [-1] * len(nodes)
+        for i in range(len(nodes)):
+            for c in self.children[i]:
+                self.parent[c] = i
+        self.nll = [n.nll for n in nodes]
+        state = GreedyRemoval(copy_tree, m)
+        self.removed = []
+        self.errors = [state.error_of_tree]
+        while True:
+            rm_node = state.step()
+            if rm_node is None:
+                break
+            self.removed.append(map_node_to_ind[rm_node])
+            self.errors.append(state.error_of_tree)
+
+    def num_removals(self, max_cost: float) -> int:
+        """
+        Finds the number of removals greedy_removal makes for the given threshold.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            int: The number of removals before the error of the tree is at most max_cost, or all removals if it never is.
+        """
+        for i, error in enumerate(self.errors):
+            if error <= max_cost:
+                return i
+        return len(self.removed)
+
+    def deleted_mask(self, max_cost: float) -> np.ndarray:
+        """
+        Computes which nodes the pruned tree of the given threshold deletes, without creating it.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            np.ndarray: Whether each node is deleted, in breadth first order.
+        """
+        deleted = np.zeros(len(self.parent), dtype=bool)
+        deleted[self.removed[: self.num_removals(max_cost)]] = True
+        # parents come before their children in breadth first order
+        for i in range(1, len(deleted)):
+            deleted[i] |= deleted[self.parent[i]]
+        return deleted
+
+    def summary(self, max_cost: float) -> Dict[str, Any]:
+        """
+        Summarizes the pruned tree of the given threshold like result, without creating it.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            dict: The deleted mask and the error_of_tree, frac_included and check of the pruned tree.
+        """
+        deleted = self.deleted_mask(max_cost)
+        # summed bottom up in the order of calculate_error_of_tree_undeleted
+        errors = [0] * len(deleted)
+        for i in range(len(deleted) - 1, -1, -1):
+            if not deleted[i]:
+                errors[i] = self.nll[i] + sum([errors[c] for c in self.children[i]])
+        error_of_tree = errors[0]
+        return {
+            "deleted": deleted,
+            "check": "sat" if error_of_tree <= max_cost else "unsat",
+            "error_of_tree": error_of_tree,
+            "frac_included": int(np.sum(~deleted)) / len(deleted),
+        }
+
+    def result(
+        self, max_cost: float
+    ) -> Dict[str, Union[ast_helper.Node, str, float, float]]:
+        """
+        Materializes the pruned tree of the given threshold from a prefix of the trace.
+
+        Args:
+            max_cost (float): The maximum total cost threshold.
+
+        Returns:
+            dict: A dictionary containing the pruned tree for the threshold, as returned by greedy_removal.
+        """
+        root = duplicate_tree(self.tree)
+        nodes = bfs_nodes(root)
+        for ind in self.removed[: self.num_removals(max_cost)]:
+            del_node_and_all_children(nodes[ind])
+        error_of_tree = calculate_error_of_tree_undeleted(root)
+        return {
+            "pruned_root": rm_deleted_nodes(duplicate_tree(root)),
+            "entire_tree_with_deleted": root,
+            "check": "sat" if error_of_tree <= max_cost else "unsat",
+            "error_of_tree": error_of_tree,
+            "frac_included": num_node_not_deleted(root) / len(nodes),
+        }
+
+
 def create_tree_from_optimization_result_lst(
     tree: ast_helper.Node, m: int, max_cost_threshold: List[float]
-) -> List[Dict[str, Union[ast_helper.Node, str, float, float]]]:
+) -> Sequence:
     """
     Creates a list of pruned trees from the given tree for each maximum cost threshold in the given list.
 
+    The greedy removals are computed once for all thresholds, and the pruned tree of each threshold is created when
+    it is accessed.
+
     Args:
         tree (Node): The root node of the tree to prune.
-        m (int): The minimum number of nodes to keep in the tree.
+        m (int): The maximum number of holes in the tree.
         max_cost_threshold (List[float]): A list of maximum total cost thresholds.
 
     Returns:
-        list: A list of dictionaries, each containing a pruned tree for a maximum cost threshold in the given list.
+        Sequence: A sequence of dictionaries, each containing a pruned tree for a maximum cost threshold in the given list.
     """
-    pruned_tree_data = []
-    for max_cost in max_cost_threshold:
-        copy_tree = duplicate_tree(tree)
-        pruned_tree_data.append(greedy_removal(copy_tree, max_cost, m))
-    return pruned_tree_data
+    trace = GreedyTrace(tree, m)
+    return PrunedTreeSequence(trace.result, max_cost_threshold, trace.summary)
@@ -1,9 +1,22 @@
 import os
 import sys
 import numpy as np
-from typing import List, Callable, Dict, Union, Any
+from typing import (
+    List,
+    Callable,
+    Dict,
+    Union,
+    Any,
+    Optional,
+    Set,
+    Iterator,
+    Tuple,
+    Sequence,
+)
+from types import ModuleType
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import traceback
-import ipdb
 import argparse
 
 BASE_DIR = os.path.dirname(__file__)
@@ -12,11 +25,14 @@ sys.path.append(ROOT_DIR)
 sys.path.append(BASE_DIR)
 
 import parse_results
+import compact_output
+import compact_tree
+from pruned_sequence import PrunedTreeSequence
 from utils import utils
-import optimize
 import ast_helper
+import config
 
-PATH_TO_OUTPUT = "/home/akhakhar/shared/code-davinci"
+PATH_TO_OUTPUT = config.get("OUTPUT_PATH")
 
 
 def retrieve_results(
@@ -35,8 +51,8 @@ def retrieve_results(
         Any: The output after applying the function to each file.
     """
     for directory in directories:
-        for file in [f for f in os.listdir(f"{PATH_TO_OUTPUT}/{directory}")]:
-            fn(f"{PATH_TO_OUTPUT}/{directory}/{file}", output)
+        for file in [f for f in os.listdir(f"{path}/{directory}")]:
+            fn(f"{path}/{directory}/{file}", output)
     return output
 
 
@@ -58,6 +74,7 @@ def is_subtree(
     Returns:
         dict: A dictionary containing a boolean indicating whether the pruned tree is a subtree of the target tree, and a reason for the result.
     """
+
     # check if pruned tree is subtree of target tree
     def get_string_intervals(code, n):
         return "#".join([code[t[0] : t[1]] for t in n.intervals])
@@ -117,92 +134,500 @@ def is_subtree(
         }
 
 
+def load_solver(solver: str) -> ModuleType:
+    """
+    Imports the optimization module of the given solver.
+
+    Args:
+        solver (str): The name of the solver, one of "dp", "z3" or "greedy".
+
+    Returns:
+        ModuleType: The module providing create_tree_from_optimization_result_lst.
+    """
+    if solver == "z3":
+        import optimize
+    elif solver == "greedy":
+        import optimize_greedy as optimize
+    else:
+        import optimize_dp as optimize
+    return optimize
+
+
+def parse_sample(
+    sample: Dict[str, Any],
+) -> Optional[Tuple[str, str, ast_helper.Node, ast_helper.Node]]:
+    """
+    Parses the first line of the prediction of a sample, with its probabilities, and the target solution into trees.
+
+    Args:
+        sample (dict): The inference result of the sample.
+
+    Returns:
+        tuple: The prediction string, the target string, the prediction tree and the target tree, or None if the
+            prediction or target cannot be parsed.
+    """
+    pred_str = "return" + sample["response"]["choices"][0]["text"].split("\n")[0]
+    target_str = sample["prompt"]["solution"].strip()
+    try:
+        pred_tree = parse_results.code_to_final_ast(pred_str)
+        parse_results.add_probability_to_nodes(
+            pred_tree, sample["response"]["choices"][0]
+        )
+        target_tree = parse_results.code_to_final_ast(target_str)
+    except:
+        traceback.print_exc()
+        return None
+    return pred_str, target_str, pred_tree, target_tree
+
+
+def summarize_output(
+    pruned_tree_data: Sequence, j: int, pred: compact_tree.CompactTree
+) -> Optional[Dict[str, Any]]:
+    """
+    Summarizes the optimization output of a tau by its deleted mask and its fields other than the trees.
+
+    Solvers returning a PrunedTreeSequence with a summarize function are summarized without creating the pruned tree.
+
+    Args:
+        pruned_tree_data (Sequence): The optimization output of each tau.
+        j (int): The index of the tau.
+        pred (CompactTree): The tree of the prediction.
+
+    Returns:
+        dict: The deleted mask in breadth first order, under "deleted", the fields of compact_output.OUTPUT_KEYS, and
+            the breadth first indices of the nodes of the map and the tuples, under "map_inds" and "tuples", if the
+            output has a map that they cannot be rebuilt from. None if the tau has no pruned tree.
+    """
+    if (
+        isinstance(pruned_tree_data, PrunedTreeSequence)
+        and pruned_tree_data.summarize is not None
+    ):
+        return pruned_tree_data.summary(j)
+    optimize_output = pruned_tree_data[j]
+    if optimize_output is None:
+        return None
+    summary = {
+        key: optimize_output[key]
+        for key in compact_output.OUTPUT_KEYS
+        if key in optimize_output
+    }
+    if "check" in summary:
+        summary["check"] = str(summary["check"])
+    summary["deleted"] = compact_tree.deleted_masks(
+        [optimize_output["entire_tree_with_deleted"]]
+    )[0]
+    if "map" in optimize_output:
+        summary["map_inds"] = [
+            ind
+            for ind in range(len(pred))
+            if f"{pred.node_code(ind)}::{ind}" in optimize_output["map"]
+        ]
+        summary["tuples"] = optimize_output["tuples"]
+    return summary
+
+
+def bisect_pred_in_target(
+    target: compact_tree.CompactTree,
+    pred: compact_tree.CompactTree,
+    summaries: List[Optional[Dict[str, Any]]],
+) -> Optional[Dict[int, Dict[str, Any]]]:
+    """
+    Finds whether the pruned tree of every tau is a subtree of the target with a binary search over the taus.
+
+    The pruned trees must be nested, with more nodes deleted at every later tau. Deleting nodes from a subtree of
+    the target keeps it a subtree, so the check flips from False to True at most once along the taus and only
+    O(log T) deleted masks are checked. The other taus copy the result of the closest checked tau on their side of
+    the flip, with its index in "inferred_from".
+
+    Args:
+        target (CompactTree): The target tree.
+        pred (CompactTree): The tree of the prediction.
+        summaries (List[dict]): The summary of the optimization output of each tau, as returned by summarize_output,
+            in order of decreasing threshold.
+
+    Returns:
+        dict: The result of each tau index, or None if a checked tau has no pruned tree.
+    """
+    checked = {}
+    lo, hi = 0, len(summaries)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if summaries[mid] is None:
+            return None
+        checked[mid] = compact_tree.is_subtree_batch(
+            target, pred, summaries[mid]["deleted"][None, :]
+        )[0]
+        if checked[mid]["eval"]:
+            hi = mid
+        else:
+            lo = mid + 1
+    # lo - 1 and lo are checked whenever they are in range
+    pred_in_target = {}
+    for j in range(len(summaries)):
+        if j in checked:
+            pred_in_target[j] = checked[j]
+        else:
+            k = lo - 1 if j < lo else lo
+            pred_in_target[j] = dict(checked[k], inferred_from=k)
+    return pred_in_target
+
+
+def process_sample(
+    i: int,
+    sample: Dict[str, Any],
+    m: int,
+    solver: str,
+    taus: List[float],
+    max_costs: List[float],
+    print_flag: bool = False,
+    bisect: bool = False,
+    compact: bool = False,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Prunes the prediction of a sample for every tau and checks whether each pruned tree is a subtree of the target.
+
+    Args:
+        i (int): The index of the sample.
+        sample (dict): The inference result of the sample.
+        m (int): The maximum number of holes in the tree.
+        solver (str): The name of the solver.
+        taus (List[float]): The taus to prune for.
+        max_costs (List[float]): The maximum total cost threshold of each tau.
+        print_flag (bool, optional): Whether to print every pruned tree. Defaults to False.
+        bisect (bool, optional): Whether to check the taus with bisect_pred_in_target when the solver nests its
+            pruned trees. Defaults to False.
+        compact (bool, optional): Whether to return the compact record of the sample, built from the deleted masks of
+            the taus without serializing the pruned tree of each tau. Defaults to False.
+
+    Returns:
+        list: The result of each tau, or the compact record of the sample if compact, or None if the prediction or
+            target cannot be parsed.
+    """
+    optimize = load_solver(solver)
+    output_data = []
+    parsed = parse_sample(sample)
+    if parsed is None:
+        return None
+    pred_str, target_str, pred_tree, target_tree = parsed
+    pruned_tree_data = optimize.create_tree_from_optimization_result_lst(
+        pred_tree, m, max_costs
+    )
+    target_compact = compact_tree.CompactTree.from_node(target_tree)
+    pred_compact = compact_tree.CompactTree.from_node(pred_tree)
+    summaries = [
+        summarize_output(pruned_tree_data, j, pred_compact)
+        for j in range(len(pruned_tree_data))
+    ]
+    valid = [j for j, summary in enumerate(summaries) if summary is not None]
+    pred_in_target = None
+    if (
+        bisect
+        and getattr(optimize, "NESTED_THRESHOLDS", False)
+        and np.all(np.diff(max_costs) <= 0)
+    ):
+        pred_in_target = bisect_pred_in_target(target_compact, pred_compact, summaries)
+    if pred_in_target is None:
+        # every tau is checked against the target in a single walk of the two trees
+        pred_in_target = dict(
+            zip(
+                valid,
+                compact_tree.is_subtree_batch(
+                    target_compact,
+                    pred_compact,
+                    np.array([summaries[j]["deleted"] for j in valid]).reshape(
+                        len(valid), len(pred_compact)
+                    ),
+                ),
+            )
+        )
+    if compact:
+        if print_flag:
+            for j in valid:
+                print(f"\t[{j}/{len(summaries)}]")
+                print("Pruned Tree")
+                print(pred_str)
+                print(pred_compact.with_deleted(summaries[j]["deleted"]))
+                print("Target")
+                print(target_str)
+                print(target_tree)
+                print("-" * 10)
+                print(pred_in_target[j])
+        if len(valid) == 0:
+            return []
+        record = {
+            "data_ind": i,
+            "pred_str": pred_str,
+            "target_str": target_str,
+            "pred_in_target": [pred_in_target[j] for j in valid],
+            "cost": [max_costs[j] for j in valid],
+            "tau": [taus[j] for j in valid],
+            "tau_ind": valid,
+        }
+        for key in compact_output.OUTPUT_KEYS:
+            if key in summaries[valid[0]]:
+                record[key] = [summaries[j][key] for j in valid]
+        return [
+            compact_output.build_sample_output(
+                record,
+                pred_compact.with_deleted(
+                    np.zeros(len(pred_compact), dtype=bool)
+                ).toJSON(),
+                np.array([summaries[j]["deleted"] for j in valid]),
+                map_inds=summaries[valid[0]].get("map_inds"),
+                tuples=(
+                    [summaries[j]["tuples"] for j in valid]
+                    if "tuples" in summaries[valid[0]]
+                    else None
+                ),
+            )
+        ]
+    for j, optimize_output in enumerate(pruned_tree_data):
+        save_data = {}
+        try:
+            if print_flag:
+                print(f"\t[{j}/{len(pruned_tree_data)}]")
+                print("Pruned Tree")
+                print(pred_str)
+                print(optimize_output["entire_tree_with_deleted"])
+                print("Target")
+                print(target_str)
+                print(target_tree)
+                print("-" * 10)
+                print(pred_in_target[j])
+            save_data["pred_in_target"] = pred_in_target[j]
+            save_data["pred_str"] = pred_str
+            save_data["target_str"] = target_str
+            save_data["cost"] = max_costs[j]
+            save_data["tau"] = taus[j]
+            save_data["data_ind"] = i
+            save_data["tau_ind"] = j
+            save_data["output"] = optimize_output
+            save_data["output"]["pruned_root"] = save_data["output"][
+                "pruned_root"
+            ].toJSON()
+            save_data["output"]["entire_tree_with_deleted"] = save_data["output"][
+                "entire_tree_with_deleted"
+            ].toJSON()
+            if "check" in save_data["output"]:
+                save_data["output"]["check"] = str(save_data["output"]["check"])
+            output_data.append(save_data)
+        except:
+            traceback.print_exc()
+            continue
+    return output_data
+
+
+def run_samples(
+    samples: List[Dict[str, Any]],
+    m: int,
+    solver: str,
+    taus: List[float],
+    max_costs: List[float],
+    print_flag: bool = False,
+    bisect: bool = False,
+    workers: int = 1,
+    skip_inds: Optional[Set[int]] = None,
+    compact: bool = False,
+) -> Iterator[Tuple[int, Optional[List[Dict[str, Any]]]]]:
+    """
+    Runs process_sample on every sample, spread over a pool of worker processes.
+
+    Results are yielded in the order of the samples as soon as they are available. A sample whose processing raises
+    is logged and yields None, so it does not stop the other samples. When a worker dies, the pool is recreated for
+    the unfinished samples, and only a sample that also kills a worker of its own yields None.
+
+    Args:
+        samples (List[dict]): The inference results of the samples.
+        m (int): The maximum number of holes in the tree.
+        solver (str): The name of the solver.
+        taus (List[float]): The taus to prune for.
+        max_costs (List[float]): The maximum total cost threshold of each tau.
+        print_flag (bool, optional): Whether to print every pruned tree. Defaults to False.
+        bisect (bool, optional): Whether to binary search over the taus of nested solvers. Defaults to False.
+        workers (int, optional): The number of worker processes, or 1 to run in this process. Defaults to 1.
+        skip_inds (Set[int], optional): The indices of samples to skip. Defaults to None.
+        compact (bool, optional): Whether to process the samples into compact records. Defaults to False.
+
+    Yields:
+        tuple: The index of the sample and the result of process_sample for it.
+    """
+    inds = [i for i in range(len(samples)) if skip_inds is None or i not in skip_inds]
+    if workers <= 1:
+        for i in inds:
+            print(f"[{i}/{len(samples)-1}]{'-'*10}", flush=True)
+            try:
+                sample_output = process_sample(
+                    i,
+                    samples[i],
+                    m,
+                    solver,
+                    taus,
+                    max_costs,
+                    print_flag,
+                    bisect,
+                    compact,
+                )
+            except:
+                traceback.print_exc()
+                sample_output = None
+            yield i, sample_output
+        return
+    args = (m, solver, taus, max_costs, print_flag, bisect, compact)
+    pending = inds
+    while len(pending) > 0:
+        broken = None
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(process_sample, i, samples[i], *args) for i in pending
+            ]
+            for n, (i, future) in enumerate(zip(pending, futures)):
+                try:
+                    sample_output = future.result()
+                except BrokenProcessPool:
+                    broken = n
+                    break
+                except:
+                    print(f"[{i}/{len(samples)-1}] failed", flush=True)
+                    traceback.print_exc()
+                    sample_output = None
+                print(f"[{i}/{len(samples)-1}]{'-'*10}", flush=True)
+                yield i, sample_output
+        if broken is None:
+            return
+        # a dead worker fails every unfinished sample, so the first one is run alone to find out if it killed it
+        i = pending[broken]
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                future = executor.submit(process_sample, i, samples[i], *args)
+                sample_output = future.result()
+            except:
+                print(f"[{i}/{len(samples)-1}] failed", flush=True)
+                traceback.print_exc()
+                sample_output = None
+        print(f"[{i}/{len(samples)-1}]{'-'*10}", flush=True)
+        yield i, sample_output
+        pending = pending[broken + 1 :]
+
+
+def resume_jsonl(path: str, num_taus: int) -> Set[int]:
+    """
+    Cuts an interrupted append from a per-tau JSONL output, and finds the samples it already holds.
+
+    The records of a sample are appended together, so an interrupted append leaves a partial last line, and possibly
+    only some of the taus of the last sample. Every record of a last sample without num_taus records is cut, so that
+    the sample is processed again.
+
+    Args:
+        path (str): The path of the uncompressed output.
+        num_taus (int): The number of taus of every sample.
+
+    Returns:
+        set: The data_inds of the samples left in the output.
+    """
+    utils.truncate_partial_jsonl_line(path)
+    done_inds = set()
+    last_ind, last_start, last_count = None, 0, 0
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if len(line.strip()) > 0:
+                ind = utils.loads(line)["data_ind"]
+                if ind != last_ind:
+                    last_ind, last_start, last_count = ind, offset, 0
+                last_count += 1
+                done_inds.add(ind)
+            offset += len(line)
+    if last_ind is not None and last_count != num_taus:
+        with open(path, "rb+") as f:
+            f.truncate(last_start)
+        done_inds.discard(last_ind)
+    return done_inds
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--m", dest="m", type=int, default=1)
     parser.add_argument("--dataind", dest="dataind", type=int, default=-1)
     parser.add_argument("--noprint", action="store_false")
     parser.add_argument("--nosave", action="store_true")
+    parser.add_argument(
+        "--solver", dest="solver", choices=["dp", "z3", "greedy"], default="dp"
+    )
+    parser.add_argument("--numtaus", dest="numtaus", type=int, default=100)
+    parser.add_argument("--workers", dest="workers", type=int, default=1)
+    parser.add_argument(
+        "--format",
+        dest="format",
+        choices=["compact", "jsonl", "json"],
+        default="compact",
+    )
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--bisect", action="store_true")
+    parser.add_argument("--compress", choices=["none", "gz", "zst"], default="none")
     args = parser.parse_args()
+    if args.resume and args.compress != "none":
+        # a partial last record cannot be cut out of a compressed stream
+        parser.error("--resume needs an uncompressed output")
     results = retrieve_results(
         [],
         lambda x, output: output.append(utils.read_json(x)),
         ["1672524017", "1672525916"],
     )
-    taus = np.linspace(1e-5, 1 - 1e-5, 100)
+    taus = np.linspace(1e-5, 1 - 1e-5, args.numtaus)
     max_costs = [-np.log(x) for x in taus]
 
+    os.makedirs(f"{ROOT_DIR}/results", exist_ok=True)
+    # compact stores one record per sample, with the tree written once
+    ext = {"compact": "compact.jsonl", "jsonl": "jsonl", "json": "json"}[args.format]
+    output_path = (
+        f"{ROOT_DIR}/results/optimize_output_ind_{args.dataind}__m_{args.m}.{ext}"
+    )
+    if args.compress != "none":
+        output_path += "." + args.compress
+    stream = args.format != "json" and not args.nosave
+    # data_inds already on disk are skipped when resuming
+    done_inds = set()
+    if stream and args.resume and os.path.exists(output_path):
+        if args.format == "jsonl":
+            done_inds = resume_jsonl(output_path, len(taus))
+        else:
+            utils.truncate_partial_jsonl_line(output_path)
+            done_inds = set([d["data_ind"] for d in utils.iter_jsonl(output_path)])
+        print("resuming, skipping", len(done_inds))
+    elif stream:
+        open(output_path, "w").close()
+
+    if args.bisect and not getattr(
+        load_solver(args.solver), "NESTED_THRESHOLDS", False
+    ):
+        print(
+            f"--bisect needs nested pruned trees, checking every tau with {args.solver}"
+        )
     output_data = []
     cnt_valid = 0
     print(len(results))
     results = [results[args.dataind]] if args.dataind >= 0 else results
-    for i, sample in enumerate(results):
-        print(f"[{i}/{len(results)-1}]{'-'*10}", flush=True)
-        pred_str = "return" + sample["response"]["choices"][0]["text"].split("\n")[0]
-        target_str = sample["prompt"]["solution"].strip()
-        try:
-            pred_tree = parse_results.code_to_final_ast(pred_str)
-            parse_results.add_probability_to_nodes(
-                pred_tree, sample["response"]["choices"][0]
-            )
-            target_tree = parse_results.code_to_final_ast(target_str)
-        except:
-            traceback.print_exc()
+    for _, sample_output in run_samples(
+        results,
+        args.m,
+        args.solver,
+        taus,
+        max_costs,
+        print_flag=args.noprint,
+        bisect=args.bisect,
+        workers=args.workers,
+        skip_inds=done_inds,
+        compact=args.format == "compact",
+    ):
+        if sample_output is None:
             continue
-        pruned_tree_data = optimize.create_tree_from_optimization_result_lst(
-            pred_tree, args.m, max_costs
-        )
-        for j, optimize_output in enumerate(pruned_tree_data):
-            save_data = {}
-            try:
-                if args.noprint:
-                    print(f"\t[{j}/{len(pruned_tree_data)}]")
-                    print("Pruned Tree")
-                    print(pred_str)
-                    print(optimize_output["entire_tree_with_deleted"])
-                    print("Target")
-                    print(target_str)
-                    print(target_tree)
-                    print("-" * 10)
-                    print(
-                        is_subtree(
-                            target_tree.code,
-                            target_tree,
-                            pred_tree.code,
-                            optimize_output["entire_tree_with_deleted"],
-                        )
-                    )
-                save_data["pred_in_target"] = is_subtree(
-                    target_tree.code,
-                    target_tree,
-                    pred_tree.code,
-                    optimize_output["entire_tree_with_deleted"],
-                )
-                save_data["pred_str"] = pred_str
-                save_data["target_str"] = target_str
-                save_data["cost"] = max_costs[j]
-                save_data["tau"] = taus[j]
-                save_data["data_ind"] = i
-                save_data["tau_ind"] = j
-                save_data["output"] = optimize_output
-                save_data["output"]["pruned_root"] = save_data["output"][
-                    "pruned_root"
-                ].toJSON()
-                save_data["output"]["entire_tree_with_deleted"] = save_data["output"][
-                    "entire_tree_with_deleted"
-                ].toJSON()
-                if "check" in save_data["output"]:
-                    save_data["output"]["check"] = str(save_data["output"]["check"])
-                output_data.append(save_data)
-            except:
-                traceback.print_exc()
-                continue
+        if stream:
+            # a compact sample is a single record holding every tau
+            utils.append_jsonl(output_path, sample_output)
+        else:
+            output_data += sample_output
         cnt_valid += 1
 
     print(cnt_valid)
-    os.makedirs(f"{ROOT_DIR}/results", exist_ok=True)
-    if not args.nosave:
-        utils.write_json(
-            f"{ROOT_DIR}/results/optimize_output_ind_{args.dataind}__m_{args.m}.json",
-            {"output": output_data},
-        )
+    if not args.nosave and not stream:
+        utils.write_json(output_path, {"output": output_data})
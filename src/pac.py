@@ -1,6 +1,18 @@
+import functools
+import math
 import numpy as np
+from typing import Union
 
+# returned when even zero successes exceed the desired cumulative probability
+NO_K = -1
+# number of standard deviations (plus as many trials) kept on each side of the mode of the binomial distribution,
+# the probability mass outside of it is far below double precision
+WINDOW_STDS = 20
+# number of padded window entries computed at once
+CHUNK_SIZE = 1 << 22
 
+
+@functools.lru_cache(maxsize=None)
 def compute_k(n: int, e: float, d: float) -> int:
     """
     Computes the maximum number of successes in a binomial distribution.
@@ -11,20 +23,90 @@ def compute_k(n: int, e: float, d: float) -> int:
         d (float): The desired cumulative probability.
 
     Returns:
-        int: The maximum number of successes such that the cumulative probability does not exceed d.
+        int: The maximum number of successes such that the cumulative probability does not exceed d, or NO_K if there is none.
+    """
+    return int(compute_k_array(n, e, d))
+
+
+def compute_k_array(
+    n: Union[int, np.ndarray], e: Union[float, np.ndarray], d: Union[float, np.ndarray]
+) -> np.ndarray:
+    """
+    Computes compute_k for arrays of trials, success probabilities and cumulative probabilities in one pass.
+
+    The binomial probabilities are computed in log space with cumulative sums over a window around the mode of each
+    distribution, padded to a common width.
+
+    Args:
+        n (np.ndarray): The number of trials.
+        e (np.ndarray): The probability of success on each trial.
+        d (np.ndarray): The desired cumulative probability.
+
+    Returns:
+        np.ndarray: The maximum number of successes of each broadcast (n, e, d), or NO_K if there is none.
+    """
+    n, e, d = np.broadcast_arrays(
+        np.asarray(n, dtype=np.int64),
+        np.asarray(e, dtype=float),
+        np.asarray(d, dtype=float),
+    )
+    shape = n.shape
+    n, e, d = n.ravel(), e.ravel(), d.ravel()
+    # the probabilities of the trials are clipped away from 0 and 1, which are handled below
+    p = np.clip(e, 1e-300, 1 - 1e-16)
+    width = np.ceil(WINDOW_STDS * np.sqrt(n * p * (1 - p)) + WINDOW_STDS).astype(
+        np.int64
+    )
+    mode = np.floor((n + 1) * p).astype(np.int64)
+    lo = np.clip(mode - width, 0, n)
+    hi = np.clip(mode + width, 0, n)
+    k = np.empty(len(n), dtype=np.int64)
+    # rows are processed in chunks so that the padded windows fit in memory
+    rows = max(1, CHUNK_SIZE // int((hi - lo).max(initial=0) + 1))
+    for i in range(0, len(n), rows):
+        chunk = slice(i, i + rows)
+        k[chunk] = window_k(n[chunk], p[chunk], d[chunk], lo[chunk], hi[chunk])
+    k = np.where(e <= 0, np.where(d >= 1, n, NO_K), k)
+    k = np.where(e >= 1, np.where(d >= 1, n, n - 1), k)
+    k = np.where(k < 0, NO_K, k)
+    return k.reshape(shape)
+
+
+def window_k(
+    n: np.ndarray, p: np.ndarray, d: np.ndarray, lo: np.ndarray, hi: np.ndarray
+) -> np.ndarray:
+    """
+    Computes the maximum number of successes of each row from the binomial probabilities of its window.
+
+    Args:
+        n (np.ndarray): The number of trials.
+        p (np.ndarray): The probability of success on each trial, strictly between 0 and 1.
+        d (np.ndarray): The desired cumulative probability.
+        lo (np.ndarray): The first number of successes of the window.
+        hi (np.ndarray): The last number of successes of the window.
+
+    Returns:
+        np.ndarray: The maximum number of successes such that the cumulative probability does not exceed d.
     """
-    r = 0.0
-    s = 0.0
-    for h in range(n + 1):
-        if h == 0:
-            r = n * np.log(1.0 - e)
-        else:
-            r += np.log(n - h + 1) - np.log(h) + np.log(e) - np.log(1.0 - e)
-        s += np.exp(r)
-        if s > d:
-            if h == 0:
-                raise Exception()
-                # return None
-            else:
-                return h - 1
-    return n
+    h = lo[:, None] + np.arange(int((hi - lo).max(initial=0)) + 1)[None, :]
+    valid = h <= hi[:, None]
+    h = np.minimum(h, hi[:, None])
+    # log binomial coefficients of the window, from the first one and the ratio of consecutive ones
+    log_binom_lo = np.array(
+        [
+            math.lgamma(a + 1) - math.lgamma(b + 1) - math.lgamma(a - b + 1)
+            for a, b in zip(n.tolist(), lo.tolist())
+        ]
+    )
+    ratios = np.log(np.maximum(n[:, None] - h + 1, 1)) - np.log(np.maximum(h, 1))
+    ratios[:, 0] = 0
+    log_binom = log_binom_lo[:, None] + np.cumsum(np.where(valid, ratios, 0), axis=1)
+    log_pmf = (
+        log_binom + h * np.log(p)[:, None] + (n[:, None] - h) * np.log1p(-p)[:, None]
+    )
+    cdf = np.cumsum(np.where(valid, np.exp(log_pmf), 0), axis=1)
+    # the mass below the window is negligible, so the successes below it never exceed d
+    num_below = np.sum(valid & (cdf <= d[:, None]), axis=1)
+    return np.where(
+        num_below == valid.sum(axis=1), np.where(hi == n, n, hi), lo + num_below - 1
+    )
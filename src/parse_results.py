@@ -1,9 +1,9 @@
+import itertools
 import os
 import sys
 from typing import List
 import numpy as np
 
-PATH_TO_OUTPUT = "/home/akhakhar/shared/code-davinci"
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(ROOT_DIR)
@@ -11,24 +11,9 @@ sys.path.append(BASE_DIR)
 
 import ast_helper
 from utils import utils
+import config
 
-
-def populate_start_and_end(parent: ast_helper.Node) -> None:
-    """
-    Populates the start and end attributes of each node in the AST.
-
-    Args:
-        parent (ast_helper.Node): The root of the AST.
-    """
-    curr_ind = 0
-    # assumes parent.children are in order of presence
-    for child in parent.children:
-        index_in_truncated_parent = parent.code[curr_ind:].index(child.code)
-        child.start = parent.start + curr_ind + index_in_truncated_parent
-        child.end = child.start + len(child.code)
-        curr_ind = index_in_truncated_parent + len(child.code)
-    for child in parent.children:
-        populate_start_and_end(child)
+PATH_TO_OUTPUT = config.get("OUTPUT_PATH")
 
 
 def assert_start_end_are_correct(parent: ast_helper.Node, addtl: str) -> None:
@@ -83,6 +68,27 @@ def remove_all_spaces_in_code(parent: ast_helper.Node) -> ast_helper.Node:
     return parent
 
 
+def remove_all_spaces_in_positions(
+    parent: ast_helper.Node, non_space_before: List[int]
+) -> ast_helper.Node:
+    """
+    Removes all spaces in the code attribute of each node in the AST and shifts the start and end attributes to the code without spaces.
+
+    Args:
+        parent (ast_helper.Node): The root of the AST.
+        non_space_before (List[int]): The number of non space characters before each index of the original code.
+
+    Returns:
+        ast_helper.Node: The root of the AST with all spaces removed from the code.
+    """
+    parent.code = parent.code.replace(" ", "")
+    parent.start = non_space_before[parent.start]
+    parent.end = non_space_before[parent.end]
+    for c in parent.children:
+        remove_all_spaces_in_positions(c, non_space_before)
+    return parent
+
+
 def code_to_final_ast(code: str) -> ast_helper.Node:
     """
     Converts code into an AST and populates the start, end, and intervals attributes of each node.
@@ -93,49 +99,23 @@ def code_to_final_ast(code: str) -> ast_helper.Node:
     Returns:
         ast_helper.Node: The root of the AST.
     """
-    root = ast_helper.get_node(code)
-    remove_all_spaces_in_code(root)
-    populate_start_and_end(root)
-    root.end = len(root.code)
+    root = ast_helper.get_node_from_positions(code)
+    non_space_before = [0] + list(itertools.accumulate(int(c != " ") for c in code))
+    remove_all_spaces_in_positions(root, non_space_before)
     assert_start_end_are_correct(root, root.code)
     make_dependent(root)
     return root
 
 
-def intervals_to_token_probs(
-    parent: ast_helper.Node,
-    map_index_to_token_ind: dict,
-    tokens: List[str],
-    token_logprobs: List[float],
-) -> None:
-    """
-    Populates the tokens, logprobs, and nll attributes of each node in the AST.
-
-    Args:
-        parent (ast_helper.Node): The root of the AST.
-        map_index_to_token_ind (dict): A mapping from output index to token index.
-        tokens (List[str]): The list of tokens.
-        token_logprobs (List[float]): The list of log probabilities for each token.
-    """
-    token_inds = []
-    for tup in parent.intervals:
-        for output_index in range(tup[0], tup[1]):
-            token_inds.append(map_index_to_token_ind[output_index])
-    token_inds = set(token_inds)
-    for token_ind in token_inds:
-        parent.tokens.append(tokens[token_ind])
-        parent.logprobs.append(token_logprobs[token_ind])
-    parent.nll = -1 * sum(parent.logprobs)
-    for c in parent.children:
-        intervals_to_token_probs(c, map_index_to_token_ind, tokens, token_logprobs)
-
-
 def add_probability_to_nodes(
     root: ast_helper.Node, response: dict, debug: bool = False
 ) -> None:
     """
     Adds probability information to each node in the AST.
 
+    Each interval of a node is mapped to a range of token indices with a binary search over the cumulative token
+    offsets, and the negative log likelihood of each node is computed from prefix sums of the token log probabilities.
+
     Args:
         root (ast_helper.Node): The root of the AST.
         response (dict): The response from the model.
@@ -145,24 +125,74 @@ def add_probability_to_nodes(
     response["logprobs"]["tokens"] = [
         tok.replace(" ", "") for tok in response["logprobs"]["tokens"]
     ]
-    map_index_to_token_ind = {}
-    output_index = 0
-    for i in range(len(response["logprobs"]["tokens"])):
-        for _ in range(len(response["logprobs"]["tokens"][i])):
-            map_index_to_token_ind[output_index] = i
-            output_index += 1
+    tokens = response["logprobs"]["tokens"]
+    token_logprobs = response["logprobs"]["token_logprobs"]
+    token_lengths = np.array([len(tok) for tok in tokens], dtype=np.int64)
+    # output index i belongs to the first token whose end is greater than i
+    token_ends = np.cumsum(token_lengths)
     if debug:
-        for key in map_index_to_token_ind:
-            print(
-                key, "->", response["logprobs"]["tokens"][map_index_to_token_ind[key]]
-            )
+        for key in range(int(token_ends[-1]) if len(tokens) > 0 else 0):
+            print(key, "->", tokens[np.searchsorted(token_ends, key, side="right")])
         print("----")
         for i in range(len(root.code)):
             print(i, "->", root.code[i])
         print("----")
-    intervals_to_token_probs(
-        root,
-        map_index_to_token_ind,
-        response["logprobs"]["tokens"],
-        response["logprobs"]["token_logprobs"],
+
+    nodes = []
+    stack = [root]
+    while len(stack) > 0:
+        curr = stack.pop()
+        nodes.append(curr)
+        stack += curr.children
+    interval_node_inds = []
+    interval_bounds = []
+    for node_ind, node in enumerate(nodes):
+        for tup in node.intervals:
+            if tup[1] > tup[0]:
+                interval_node_inds.append(node_ind)
+                interval_bounds.append(tup)
+    interval_node_inds = np.array(interval_node_inds, dtype=np.int64)
+    interval_bounds = np.array(interval_bounds, dtype=np.int64).reshape(-1, 2)
+    if len(interval_bounds) > 0 and interval_bounds[:, 1].max() > (
+        token_ends[-1] if len(tokens) > 0 else 0
+    ):
+        raise KeyError(interval_bounds[:, 1].max() - 1)
+
+    # inclusive range of tokens covering each interval
+    first_token = np.searchsorted(token_ends, interval_bounds[:, 0], side="right")
+    last_token = np.searchsorted(token_ends, interval_bounds[:, 1] - 1, side="right")
+    # intervals of a node are in order, so only consecutive intervals can share a token
+    shared = np.zeros(len(first_token), dtype=bool)
+    shared[1:] = (interval_node_inds[1:] == interval_node_inds[:-1]) & (
+        first_token[1:] <= last_token[:-1]
+    )
+    first_token[shared] = last_token[np.flatnonzero(shared) - 1] + 1
+    range_lengths = np.maximum(last_token - first_token + 1, 0)
+
+    # tokens without characters after removing spaces never cover an output index
+    nonempty = token_lengths > 0
+    masked_logprobs = np.where(nonempty, np.array(token_logprobs, dtype=float), 0.0)
+    prefix = np.concatenate([[0.0], np.cumsum(masked_logprobs)])
+    range_sums = prefix[last_token + 1] - prefix[first_token]
+    range_sums[range_lengths == 0] = 0.0
+    node_nll = -np.bincount(
+        interval_node_inds, weights=range_sums, minlength=len(nodes)
+    )
+
+    # token indices of every range, in order
+    range_offsets = np.cumsum(range_lengths) - range_lengths
+    token_inds = np.arange(range_lengths.sum()) + np.repeat(
+        first_token - range_offsets, range_lengths
     )
+    token_node_inds = np.repeat(interval_node_inds, range_lengths)
+    keep = nonempty[token_inds]
+    token_inds = token_inds[keep]
+    token_node_inds = token_node_inds[keep]
+    node_token_offsets = np.searchsorted(token_node_inds, np.arange(len(nodes) + 1))
+    for node_ind, node in enumerate(nodes):
+        for token_ind in token_inds[
+            node_token_offsets[node_ind] : node_token_offsets[node_ind + 1]
+        ].tolist():
+            node.tokens.append(tokens[token_ind])
+            node.logprobs.append(token_logprobs[token_ind])
+        node.nll = float(node_nll[node_ind]) + 0.0
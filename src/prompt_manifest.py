@@ -0,0 +1,163 @@
+import os
+import sys
+import hashlib
+import functools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(ROOT_DIR)
+sys.path.append(BASE_DIR)
+
+import APPS_dataset_inference
+import humaneval_dataset_interface
+from utils import utils
+
+# keys of the prepared prompt stored in the manifest, and given back to inference
+PROMPT_KEYS = ["prompt", "solution", "n", "whole_solution"]
+# suffix of the file marking a manifest as complete, so that readers following it know when to stop
+DONE_SUFFIX = ".done"
+
+
+def num_samples(dataset: str) -> int:
+    """
+    Counts the samples of a dataset.
+
+    Args:
+        dataset (str): The name of the dataset, "humaneval" or "apps".
+
+    Returns:
+        int: The number of samples.
+    """
+    if dataset == "humaneval":
+        return len(humaneval_dataset_interface.data)
+    packed = APPS_dataset_inference.load_packed_dataset()
+    if packed is not None:
+        return len(packed)
+    return len(
+        [d for d in os.listdir(APPS_dataset_inference.PATH_TO_DATA) if d.isdigit()]
+    )
+
+
+def prepare_entry(dataset: str, i: int) -> Optional[Dict[str, Any]]:
+    """
+    Prepares the manifest entry of a sample, with the prompt preparation of its dataset.
+
+    APPS problems are prepared from their first solution, and skipped if they have none.
+
+    Args:
+        dataset (str): The name of the dataset, "humaneval" or "apps".
+        i (int): The index of the sample.
+
+    Returns:
+        dict: The index, the prepared prompt and the hash of the prompt, or None if the sample is skipped.
+    """
+    if dataset == "humaneval":
+        sample = humaneval_dataset_interface.data[i]
+        prompt_dict = humaneval_dataset_interface.prepare_inference_prompt_solution(
+            sample["prompt"], sample["canonical_solution"]
+        )
+    else:
+        try:
+            prompt_dict = APPS_dataset_inference.prepare_inference_prompt_solution(
+                APPS_dataset_inference.fetch_question(i),
+                APPS_dataset_inference.fetch_solution(i, 0),
+            )
+        except (IndexError, FileNotFoundError):
+            return None
+    if prompt_dict is None:
+        return None
+    return {
+        "index": i,
+        **{key: prompt_dict[key] for key in PROMPT_KEYS},
+        "hash": hashlib.sha256(prompt_dict["prompt"].encode("utf-8")).hexdigest(),
+    }
+
+
+def iter_entries(
+    dataset: str, inds: List[int], workers: int = 1, chunksize: int = 16
+) -> Iterator[Dict[str, Any]]:
+    """
+    Prepares the manifest entries of samples over a pool of worker processes, skipping ineligible samples.
+
+    Args:
+        dataset (str): The name of the dataset, "humaneval" or "apps".
+        inds (List[int]): The indices of the samples.
+        workers (int, optional): The number of worker processes, or 1 to run in this process. Defaults to 1.
+        chunksize (int, optional): The number of samples sent to a worker at once. Defaults to 16.
+
+    Yields:
+        dict: The entry of each eligible sample, in the order of the indices.
+    """
+    prepare = functools.partial(prepare_entry, dataset)
+    if workers <= 1:
+        for entry in map(prepare, inds):
+            if entry is not None:
+                yield entry
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for entry in executor.map(prepare, inds, chunksize=chunksize):
+            if entry is not None:
+                yield entry
+
+
+def build_manifest(
+    path: str, dataset: str, inds: List[int], workers: int = 1, chunksize: int = 16
+) -> int:
+    """
+    Writes the manifest of a dataset as JSONL, appending entries as they are prepared, and marks it as complete.
+
+    Args:
+        path (str): The path of the manifest.
+        dataset (str): The name of the dataset, "humaneval" or "apps".
+        inds (List[int]): The indices of the samples.
+        workers (int, optional): The number of worker processes. Defaults to 1.
+        chunksize (int, optional): The number of samples sent to a worker at once. Defaults to 16.
+
+    Returns:
+        int: The number of entries written.
+    """
+    if os.path.exists(path + DONE_SUFFIX):
+        os.remove(path + DONE_SUFFIX)
+    open(path, "w").close()
+    cnt = 0
+    for entry in iter_entries(dataset, inds, workers, chunksize):
+        utils.append_jsonl(path, [entry])
+        cnt += 1
+    open(path + DONE_SUFFIX, "w").close()
+    return cnt
+
+
+def follow_manifest(
+    path: str, poll_interval: float = 1.0
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Reads a manifest as build_manifest appends to it, until it is marked as complete.
+
+    Args:
+        path (str): The path of the manifest.
+        poll_interval (float, optional): The seconds to wait for new entries. Defaults to 1.0.
+
+    Yields:
+        tuple: The index and the prepared prompt of each entry, as returned by inference.prepare_humaneval_prompt.
+    """
+    is_done = lambda: os.path.exists(path + DONE_SUFFIX)
+    for entry in utils.follow_jsonl(path, is_done, poll_interval):
+        yield entry["index"], {key: entry[key] for key in PROMPT_KEYS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", choices=["humaneval", "apps"], default="humaneval")
+    parser.add_argument("--workers", dest="workers", type=int, default=1)
+    parser.add_argument("--output", dest="output", type=str, default=None)
+    args = parser.parse_args()
+    output = args.output
+    if output is None:
+        os.makedirs(f"{ROOT_DIR}/results", exist_ok=True)
+        output = f"{ROOT_DIR}/results/manifest__{args.dataset}.jsonl"
+    inds = list(range(num_samples(args.dataset)))
+    cnt = build_manifest(output, args.dataset, inds, args.workers)
+    print(output, cnt, "of", len(inds))
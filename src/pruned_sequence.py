@@ -0,0 +1,45 @@
+from collections.abc import Sequence
+from typing import List, Optional, Dict, Callable, Any
+
+
+class PrunedTreeSequence(Sequence):
+    """
+    A sequence of pruned trees, one per maximum cost threshold, materialized when accessed.
+
+    Attributes:
+        create (Callable): The function creating the pruned tree of a threshold.
+        max_cost_threshold (list): The maximum total cost thresholds.
+        summarize (Callable): The function summarizing the pruned tree of a threshold without creating it, or None.
+    """
+
+    def __init__(
+        self,
+        create: Callable,
+        max_cost_threshold: List[float],
+        summarize: Optional[Callable] = None,
+    ):
+        self.create = create
+        self.max_cost_threshold = max_cost_threshold
+        self.summarize = summarize
+
+    def __len__(self):
+        return len(self.max_cost_threshold)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.create(self.max_cost_threshold[i])
+
+    def summary(self, i: int) -> Dict[str, Any]:
+        """
+        Summarizes the pruned tree of a threshold without creating it.
+
+        Args:
+            i (int): The index of the threshold.
+
+        Returns:
+            dict: The deleted mask of the tree in breadth first order, under "deleted", and the error_of_tree,
+                frac_included and check of the pruned tree, with the breadth first indices of the nodes of its map under
+                "map_inds" if it has one.
+        """
+        return self.summarize(self.max_cost_threshold[i])
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at a fixed rate per minute.
+
+    Attributes:
+        rate (float): The number of tokens added per second.
+        capacity (float): The maximum number of tokens in the bucket.
+        tokens (float): The number of tokens currently in the bucket.
+        last (float): The time the bucket was last refilled.
+        lock (asyncio.Lock): Serializes waiters, so they are served in order.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.capacity = per_minute if capacity is None else capacity
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def acquire(self, amount: float = 1):
+        """
+        Waits until the bucket holds the given number of tokens and takes them.
+
+        Args:
+            amount (float, optional): The number of tokens to take, capped at the capacity. Defaults to 1.
+        """
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    Limits requests to a number of requests and a number of tokens per minute.
+
+    Attributes:
+        requests (TokenBucket): The bucket of requests, or None if requests are not limited.
+        tokens (TokenBucket): The bucket of tokens, or None if tokens are not limited.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float],
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.requests = (
+            None if requests_per_minute is None else TokenBucket(requests_per_minute)
+        )
+        self.tokens = (
+            None if tokens_per_minute is None else TokenBucket(tokens_per_minute)
+        )
+
+    async def acquire(self, num_tokens: int = 0):
+        """
+        Waits until one more request of the given number of tokens fits in both limits.
+
+        Args:
+            num_tokens (int, optional): The number of tokens of the request. Defaults to 0.
+        """
+        if self.requests is not None:
+            await self.requests.acquire()
+        if self.tokens is not None and num_tokens > 0:
+            await self.tokens.acquire(num_tokens)
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(ROOT_DIR)
+sys.path.append(BASE_DIR)
+
+import config
+from completion_backend import CompletionBackend, ReplayBackend
+
+LOG_PATH = config.get("OUTPUT_PATH") + "/"
+
+
+def complete(backend: CompletionBackend, request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Answers a request to the completions endpoint, where the prompt may be a list of prompts.
+
+    The choice of prompt i of a list has index i, like the responses split by codex_interface.split_batch_response.
+
+    Args:
+        backend (CompletionBackend): The backend of the completions.
+        request (dict): The body of the request.
+
+    Returns:
+        dict: The response to the request.
+    """
+    kwargs = {
+        key: request[key]
+        for key in ["logprobs", "max_tokens", "model"]
+        if key in request
+    }
+    if isinstance(request["prompt"], str):
+        return backend.get_evaluation(request["prompt"], **kwargs)
+    responses = backend.get_evaluation_batch(request["prompt"], **kwargs)
+    response = {key: responses[0][key] for key in responses[0] if key != "choices"}
+    response["choices"] = [
+        dict(choice, index=i)
+        for i, r in enumerate(responses)
+        for choice in r["choices"]
+    ]
+    return response
+
+
+def make_handler(backend: CompletionBackend) -> type:
+    """
+    Creates the request handler of a server answering requests to the completions endpoint from the given backend.
+
+    Args:
+        backend (CompletionBackend): The backend of the completions.
+
+    Returns:
+        type: The request handler class.
+    """
+
+    class CompletionHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/completions"):
+                self.reply(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            try:
+                response = complete(backend, request)
+            except KeyError as e:
+                self.reply(
+                    404,
+                    {"error": {"message": str(e), "type": "invalid_request_error"}},
+                )
+                return
+            self.reply(200, response)
+
+        def reply(self, status: int, body: Dict[str, Any]):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return CompletionHandler
+
+
+if __name__ == "__main__":
+    # a local stand-in of the completions endpoint, for `inference.py --api-base http://<host>:<port>/v1`
+    # with any api key, replaying the responses of earlier runs
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay-dirs", dest="replay_dirs", nargs="+", default=[])
+    parser.add_argument("--log-path", dest="log_path", type=str, default=LOG_PATH)
+    parser.add_argument("--host", dest="host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=8000)
+    args = parser.parse_args()
+    backend = ReplayBackend([args.log_path + d for d in args.replay_dirs])
+    print("serving", len(backend.responses), "responses on", args.host, args.port)
+    ThreadingHTTPServer((args.host, args.port), make_handler(backend)).serve_forever()
@@ -0,0 +1,85 @@
+import itertools
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+import ast_helper
+import optimize_dp
+
+
+def random_tree(rng: random.Random, num_nodes: int) -> ast_helper.Node:
+    nodes = [ast_helper.Node("n0")]
+    for i in range(1, num_nodes):
+        node = ast_helper.Node(f"n{i}")
+        rng.choice(nodes).children.append(node)
+        nodes.append(node)
+    for node in nodes:
+        # some nodes have no probability, and are linked through to their descendants
+        node.nll = None if rng.random() < 0.2 else rng.uniform(0.01, 3)
+    return nodes[0]
+
+
+def feasible_sets(solver: optimize_dp.TreeKnapsack, m: int):
+    parent = {c: p for p, cs in solver.reduced_children.items() for c in cs}
+    inds = sorted(solver.reduced_children)
+    for r in range(len(inds) + 1):
+        for kept in itertools.combinations(inds, r):
+            kept = set(kept)
+            if any(i in parent and parent[i] not in kept for i in kept):
+                continue
+            holes = len([i for i in inds if i not in kept and parent.get(i) in kept])
+            if holes <= m:
+                yield kept, sum(solver.costs[i] for i in kept)
+
+
+def best_set(candidates, max_cost: float):
+    within = [(kept, cost) for kept, cost in candidates if cost <= max_cost + 1e-9]
+    return max(within, key=lambda c: (len(c[0]), -c[1]))
+
+
+@pytest.mark.parametrize("seed", range(150))
+def test_frontier_matches_brute_force(seed):
+    rng = random.Random(seed)
+    tree = random_tree(rng, rng.randint(3, 11))
+    m = rng.randint(1, 3)
+    max_costs = sorted([rng.uniform(0, 12) for _ in range(6)], reverse=True)
+    candidates = list(feasible_sets(optimize_dp.TreeKnapsack(tree, m), m))
+
+    exact = optimize_dp.compute_frontier(tree, m)
+    for max_cost in max_costs:
+        kept, cost = best_set(candidates, max_cost)
+        ind = exact.lookup(max_cost)
+        assert exact.num_kept[ind] == len(kept)
+        assert exact.costs[ind] == pytest.approx(cost)
+
+    nested = optimize_dp.compute_frontier(tree, m, max_costs)
+    prev = None
+    for max_cost in max_costs:
+        kept, cost = best_set(
+            [c for c in candidates if prev is None or c[0] <= prev], max_cost
+        )
+        ind = nested.lookup(max_cost)
+        assert len(nested.kept_nodes(ind)) == len(kept)
+        assert nested.costs[ind] == pytest.approx(cost)
+        assert prev is None or nested.kept_nodes(ind) <= prev
+        prev = nested.kept_nodes(ind)
+
+
+def test_single_threshold_is_exact():
+    rng = random.Random(0)
+    for _ in range(50):
+        tree = random_tree(rng, rng.randint(3, 11))
+        m = rng.randint(1, 3)
+        max_cost = rng.uniform(0, 12)
+        solver = optimize_dp.TreeKnapsack(tree, m)
+        kept, cost = best_set(list(feasible_sets(solver, m)), max_cost)
+        pruned = optimize_dp.create_tree_from_optimization_result_lst(
+            tree, m, [max_cost]
+        )[0]
+        assert np.sum(list(pruned["map"].values())) == len(kept)
+        assert pruned["error_of_tree"] == pytest.approx(cost)
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+openai = pytest.importorskip("openai")
+
+import codex_interface
+import inference
+import replay_server
+from completion_backend import (
+    NGramBackend,
+    OpenAIBackend,
+    ReplayBackend,
+    estimate_num_tokens,
+)
+
+MAX_TOKENS = 5
+
+
+@pytest.fixture
+def server(tmp_path):
+    ngram = NGramBackend(
+        ["def f(x):\n    return x + 1\n", "def g(a, b):\n    return a * b\n"]
+    )
+    # prompts of the same length, so every request takes the same number of tokens
+    prompts = {
+        i: {"prompt": f"def h{i}(y):\n    return" + " y" * 2000, "solution": "return y"}
+        for i in range(10, 16)
+    }
+    replay_dir = tmp_path / "replay"
+    replay_dir.mkdir()
+    (tmp_path / "log").mkdir()
+    for i, prompt_dict in prompts.items():
+        response = ngram.get_evaluation(prompt_dict["prompt"], max_tokens=MAX_TOKENS)
+        with open(replay_dir / f"{i}.json", "w") as f:
+            json.dump({"prompt": prompt_dict, "response": response}, f)
+    httpd = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        replay_server.make_handler(ReplayBackend([str(replay_dir)])),
+    )
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    api_base, api_key = openai.api_base, openai.api_key
+    openai.api_base = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    openai.api_key = "replay"
+    yield prompts, ngram
+    openai.api_base, openai.api_key = api_base, api_key
+    httpd.shutdown()
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_async_runner_against_replay_server(server, tmp_path, batch_size):
+    prompts, ngram = server
+    prompts[13] = None
+    inds = sorted(prompts)
+    results = asyncio.run(
+        inference.run_inference_humaneval(
+            inds,
+            str(tmp_path / "log") + "/",
+            concurrency=2,
+            requests_per_minute=None,
+            max_tokens=MAX_TOKENS,
+            batch_size=batch_size,
+            backend=OpenAIBackend(),
+            prepare_prompt=prompts.get,
+        )
+    )
+    assert results[inds.index(13)] is None
+    for i, data in zip(inds, results):
+        if prompts[i] is None:
+            continue
+        expected = ngram.get_evaluation(prompts[i]["prompt"], max_tokens=MAX_TOKENS)
+        assert data["prompt"] == prompts[i]
+        assert data["response"]["choices"][0]["text"] == expected["choices"][0]["text"]
+        assert (
+            data["response"]["choices"][0]["logprobs"]["token_logprobs"]
+            == expected["choices"][0]["logprobs"]["token_logprobs"]
+        )
+
+
+def test_async_runner_paces_tokens(server, tmp_path):
+    prompts, _ = server
+    inds = sorted(prompts)
+    num_tokens = estimate_num_tokens(prompts[inds[0]]["prompt"], MAX_TOKENS)
+    # the bucket starts full, so the requests past its capacity wait for it to refill
+    tokens_per_minute = len(inds) * num_tokens * 60 / 61.5
+    wait = (len(inds) * num_tokens - tokens_per_minute) / (tokens_per_minute / 60)
+    start = time.monotonic()
+    results = asyncio.run(
+        inference.run_inference_humaneval(
+            inds,
+            str(tmp_path / "log") + "/",
+            concurrency=len(inds),
+            requests_per_minute=None,
+            tokens_per_minute=tokens_per_minute,
+            max_tokens=MAX_TOKENS,
+            backend=OpenAIBackend(),
+            prepare_prompt=prompts.get,
+        )
+    )
+    elapsed = time.monotonic() - start
+    assert all(data is not None for data in results)
+    assert wait == pytest.approx(1.5)
+    assert wait <= elapsed < wait + 1.5
@@ -1,30 +1,143 @@
 import os
+import gzip
 import json
-from typing import List
+import time
+from typing import Any, Callable, Iterable, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPRESSED_EXTENSIONS = [".gz", ".zst"]
+# orjson writes nan and inf as null, so it only encodes when enabled, for outputs without them
+FAST_ENCODE = orjson is not None and os.environ.get("PAC_JSON_ENCODER") == "orjson"
+
+
+def open_file(path: str, mode: str = "r"):
+    # gzip or zstd compression is chosen from the extension, in text mode unless the mode is binary
+    if not path.endswith(tuple(COMPRESSED_EXTENSIONS)):
+        return open(path, mode)
+    text = "b" not in mode
+    mode = mode + "t" if text else mode
+    encoding = "utf-8" if text else None
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding=encoding)
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f"zstandard is needed for {path}, pip install zstandard")
+    return zstandard.open(path, mode, encoding=encoding)
+
+
+def resolve_path(path: str) -> str:
+    # the path itself, or its compressed version if only that exists
+    if os.path.exists(path):
+        return path
+    for ext in COMPRESSED_EXTENSIONS:
+        if os.path.exists(path + ext):
+            return path + ext
+    return path
+
+
+def loads(s) -> Any:
+    # orjson reads integers above 64 bits as floats, none of which are stored by this repo
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # such as nan and inf, written by the standard encoder
+            pass
+    return json.loads(s)
+
+
+def dumps(d: Any) -> str:
+    if FAST_ENCODE:
+        try:
+            return orjson.dumps(d, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(d)
+
 
 def read_file(path):
-    with open(path) as f:
+    with open_file(path) as f:
         return str(f.read())
 
 
 def read_json(path):
-    with open(path) as f:
-        return json.load(f)
+    with open_file(path) as f:
+        return loads(f.read())
 
 
 def write_json(path: str, d: dict):
-    with open(path, "w") as f:
-        json.dump(d, f)
+    with open_file(path, "w") as f:
+        f.write(dumps(d))
 
 
 def read_jsonl(path):
-    l = []
-    with open(path) as f:
-        json_list = list(f)
-    for json_str in json_list:
-        result = json.loads(json_str)
-        l.append(result)
-    return l
+    return list(iter_jsonl(path))
+
+
+def iter_jsonl(path):
+    with open_file(path) as f:
+        for json_str in f:
+            if len(json_str.strip()) > 0:
+                yield loads(json_str)
+
+
+def follow_jsonl(path: str, is_done: Callable[[], bool], poll_interval: float = 1.0):
+    # like iter_jsonl on an uncompressed file still being appended to, until is_done() holds and all is read
+    while not os.path.exists(path):
+        time.sleep(poll_interval)
+    with open(path, "rb") as f:
+        partial = b""
+        while True:
+            done = is_done()
+            for line in iter(f.readline, b""):
+                partial += line
+                if partial.endswith(b"\n"):
+                    if len(partial.strip()) > 0:
+                        yield loads(partial)
+                    partial = b""
+            if done:
+                return
+            time.sleep(poll_interval)
+
+
+def append_jsonl(path: str, l: List[dict]):
+    # single write per call, so a batch of records is flushed together
+    with open_file(path, "a") as f:
+        f.write("".join([dumps(d) + "\n" for d in l]))
+
+
+def write_jsonl(path: str, records: Iterable[dict], batch_size: int = 1024):
+    # records may be a generator, they are encoded and written batch_size at a time
+    with open_file(path, "w") as f:
+        batch = []
+        for d in records:
+            batch.append(dumps(d) + "\n")
+            if len(batch) >= batch_size:
+                f.write("".join(batch))
+                batch = []
+        f.write("".join(batch))
+
+
+def truncate_partial_jsonl_line(path: str, chunk_size: int = 1 << 16):
+    # drop a trailing line left incomplete by an interrupted append, of an uncompressed file
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            read_start = max(0, pos - chunk_size)
+            f.seek(read_start)
+            chunk = f.read(pos - read_start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                f.truncate(read_start + newline + 1)
+                return
+            pos = read_start
+        f.truncate(0)
 
 
 def comment_out_lines(s, start=-1, end=-1):
@@ -46,4 +159,4 @@ def replace_all_print_with_return(l: List[str]) -> List[str]:
         if "print(" in l[i]:
             l[i] = l[i].rstrip()[:-1]  # rm ending paranthesis
             l[i] = l[i].replace("print(", "return ")
-    return l
\ No newline at end of file
+    return l